@@ -1,5 +1,78 @@
 TABLE_LEAGUES, TABLE_FIXTURES, TABLE_ODDS, TABLE_RESULTS, TABLE_BETS, TABLE_USERS = 'leagues', 'fixtures', 'odds', 'results', 'bets', 'users'
 
+# Timestamps (fixtures.starts, bets.starts, bets.bet_added) are stored as naive local time of this timezone
+STORAGE_TIMEZONE = 'Europe/Vienna'
+
+# Applied schema migrations (see schema.py)
+TABLE_SCHEMA_MIGRATIONS = 'schema_migrations'
+
+# Deleted bets are only marked (bets.delete_bet = 1) on the request path and physically removed by a background purge
+BETS_PURGE_INTERVAL, BETS_PURGE_BATCH_SIZE = 3600, 1000
+
+# Deleted bets are kept BETS_DELETED_RETENTION seconds before they are purged, so delta polls of open sessions still see the deletion.
+# Sessions that didn't poll for longer reload their bets. Changes are polled with an overlap of BETS_CHANGES_OVERLAP seconds,
+# so transactions committing while the previous poll ran are not missed
+BETS_DELETED_RETENTION, BETS_CHANGES_OVERLAP = 86400, 5
+
+# Added bets are queued (at most BETS_WRITE_QUEUE_SIZE, waiting up to BETS_WRITE_QUEUE_TIMEOUT seconds for a free slot) and inserted
+# by a background worker in batches of up to BETS_WRITE_BATCH_SIZE bets. Transient failures are retried after BETS_WRITE_RETRY_DELAY seconds,
+# doubling up to BETS_WRITE_RETRY_MAX_DELAY seconds. Bets the database rejects are logged and dropped
+BETS_WRITE_QUEUE_SIZE, BETS_WRITE_QUEUE_TIMEOUT, BETS_WRITE_BATCH_SIZE, BETS_WRITE_RETRY_DELAY, BETS_WRITE_RETRY_MAX_DELAY = 1000, 1, 100, 1, 60
+
+# Bulk imports are inserted in chunks of BETS_IMPORT_CHUNK_SIZE rows (one transaction per chunk)
+BETS_IMPORT_CHUNK_SIZE = 1000
+
+# Shared reference data is no longer dropped by bet writes, so it expires by time (seconds)
+FIXTURES_CACHE_TTL, ODDS_CACHE_TTL = 300, 60
+
+# After expiry, reference data is served stale for up to these many seconds while one background query refreshes it
+FIXTURES_STALE_TTL, ODDS_STALE_TTL = 300, 60
+
+# Maximum number of fixtures returned by a fixture search
+FIXTURES_SEARCH_LIMIT = 100
+
+# Maximum number of calendar days of a fixture search. Without search words (listing all fixtures) at most FIXTURES_BROWSE_MAX_DAYS days are listed,
+# the LIKE & EXISTS predicates are evaluated for every fixture of the range before the limit applies
+FIXTURES_SEARCH_MAX_DAYS, FIXTURES_BROWSE_MAX_DAYS = 31, 3
+
+# Filter selections (or exclusions) with more than BETS_FILTER_TABLE_MIN_VALUES values are joined from a temporary table instead of an IN list
+BETS_FILTER_TABLE_MIN_VALUES = 500
+
+# Number of bets loaded per page of the bets table (keyset paging on starts, id)
+BETS_PAGE_SIZE = 500
+
+# Odds of the first ODDS_PREFETCH_COUNT listed fixtures are fetched in the background (0 disables the prefetch)
+ODDS_PREFETCH_COUNT = 20
+
+# User settings are saved write-behind, once no setting of a user changed for SETTINGS_WRITE_DELAY seconds
+SETTINGS_WRITE_DELAY = 2
+
+# Connection pool of the database engine, sized against the number of Streamlit sessions per replica
+# Size & overflow in connections, recycle & timeout in seconds. DB_POOL_WARM_UP connections are opened at process start
+DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT, DB_POOL_PRE_PING, DB_POOL_WARM_UP = 10, 10, 1800, 10, True, 5
+
+# Read replicas (names of sql connections in .streamlit/secrets.toml, like the primary 'pinnacle') serving reference data (fixtures,
+# odds) and bets of users who didn't write within the last DB_REPLICA_MAX_LAG seconds. No replicas: all reads go to the primary
+DB_READ_REPLICAS, DB_REPLICA_MAX_LAG = (), 10
+
+# Statement timeouts of reads in seconds (MySQL max_execution_time, the server aborts a SELECT running longer than this).
+# DB_STATEMENT_TIMEOUTS per db function, DB_STATEMENT_TIMEOUT for all other reads
+DB_STATEMENT_TIMEOUT = 10
+DB_STATEMENT_TIMEOUTS = dict(search_fixtures=3, get_odds_by_event_ids=5, get_fixtures_by_event_ids=10, get_odds_by_import_keys=30, get_bets_page=5, get_bets_performance=10, get_bet_summary=5, get_user_facets=5, get_bets_changed_since=5, get_bets_sync_point=3)
+
+# Replica reads still running after DB_HEDGE_DELAY seconds are also sent to a second source (the next replica or the primary), the first result wins. None disables hedging
+DB_HEDGE_DELAY = None
+
+# After DB_BREAKER_FAILURES consecutive failed reads the circuit breaker opens: for DB_BREAKER_COOLDOWN seconds guarded reads don't query the database
+# but serve their last result (marked as stale), then one read probes the database. The last results of up to DB_FALLBACK_MAX_ENTRIES calls are kept
+DB_BREAKER_FAILURES, DB_BREAKER_COOLDOWN, DB_FALLBACK_MAX_ENTRIES = 3, 30, 1000
+
+# Number of threads running independent page-load queries concurrently (should not exceed DB_POOL_SIZE)
+DB_QUERY_WORKERS = 8
+
+# Usernames (stripe email addresses) allowed to see the connection pool statistics (?pool_stats=1 in the url)
+ADMIN_USERS = ()
+
 TEXT_LANDING_PAGE = """
 
 ## **TRACK-A-BET. Separate the SIGNAL from the noise.**
@@ -2,220 +2,1164 @@
 # The module 'db_pinnacle_remote2.py' uses mysql-connector-python
 
 import time
+import queue
+import logging
+import threading
+import itertools
+import functools
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor, Future, wait, as_completed
+from collections import OrderedDict
 import streamlit as st
-from sqlalchemy import text
-from datetime import datetime
-from config import TABLE_LEAGUES, TABLE_FIXTURES, TABLE_ODDS, TABLE_BETS, TABLE_USERS
+from sqlalchemy import text, bindparam, event, exc
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+from datetime import datetime, timedelta
+from config import TABLE_FIXTURES, TABLE_ODDS, TABLE_BETS, TABLE_USERS, BETS_PURGE_INTERVAL, BETS_PURGE_BATCH_SIZE, BETS_IMPORT_CHUNK_SIZE, FIXTURES_CACHE_TTL, ODDS_CACHE_TTL, FIXTURES_STALE_TTL, ODDS_STALE_TTL, FIXTURES_SEARCH_LIMIT, FIXTURES_SEARCH_MAX_DAYS, FIXTURES_BROWSE_MAX_DAYS, ODDS_PREFETCH_COUNT, BETS_PAGE_SIZE, BETS_DELETED_RETENTION, BETS_CHANGES_OVERLAP, SETTINGS_WRITE_DELAY
+from config import BETS_FILTER_TABLE_MIN_VALUES, BETS_WRITE_QUEUE_SIZE, BETS_WRITE_QUEUE_TIMEOUT, BETS_WRITE_BATCH_SIZE, BETS_WRITE_RETRY_DELAY, BETS_WRITE_RETRY_MAX_DELAY
+from config import DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_RECYCLE, DB_POOL_TIMEOUT, DB_POOL_PRE_PING, DB_POOL_WARM_UP, DB_QUERY_WORKERS, DB_READ_REPLICAS, DB_REPLICA_MAX_LAG
+from config import DB_STATEMENT_TIMEOUT, DB_STATEMENT_TIMEOUTS, DB_HEDGE_DELAY, DB_BREAKER_FAILURES, DB_BREAKER_COOLDOWN, DB_FALLBACK_MAX_ENTRIES
 
-conn = st.connection('pinnacle', type='sql')
+logger = logging.getLogger(__name__)
 
+conn = st.connection('pinnacle', type='sql', pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE, pool_timeout=DB_POOL_TIMEOUT, pool_pre_ping=DB_POOL_PRE_PING)
+# Read-only connections, see read_replica. Writes, delta polls and bets of users who just wrote always use the primary conn
+replicas = [st.connection(name, type='sql', pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_recycle=DB_POOL_RECYCLE, pool_timeout=DB_POOL_TIMEOUT, pool_pre_ping=DB_POOL_PRE_PING) for name in DB_READ_REPLICAS]
+replica_counter = itertools.count()
 
-@st.cache_data()
-def get_leagues(sport_id: int):
+
+@st.cache_resource()
+def get_pool_monitor():
     """
-    Fetches leagues associated with a specific sport from the database.
+    Registers the pool statistics listeners on the engine and warms up the pool by opening DB_POOL_WARM_UP
+    connections. Runs once per process (cached as a resource).
 
-    This function uses the Streamlit caching mechanism to store
-    the query results persistently, optimizing performance for recurring
-    requests. The function retrieves league IDs and league names matching
-    the provided sport ID.
+    :return: The mutable pool statistics (counters and wait times) updated by the listeners and by connect().
+    :rtype: dict
+    """
+    monitor = dict(lock=threading.Lock(), checkouts=0, overflow_checkouts=0, timeouts=0, waits=0, wait_total=0.0, wait_max=0.0)
 
-    :param sport_id: The identifier of the sport for which leagues data
-        should be fetched.
-    :type sport_id: int
-    :return: A list of tuples where each tuple contains league ID and league
-        name for leagues associated with the given sport.
-    :rtype: list[tuple[int, str]]
+    @event.listens_for(conn.engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        with monitor['lock']:
+            monitor['checkouts'] += 1
+            if conn.engine.pool.overflow() > 0:
+                monitor['overflow_checkouts'] += 1
+
+    warm_up = [conn.engine.connect() for i in range(min(DB_POOL_WARM_UP, DB_POOL_SIZE))]
+    for connection in warm_up:
+        connection.close()
+
+    return monitor
+
+
+def connect():
+    """
+    Checks out a connection from the pool and records how long the checkout waited.
+
+    :return: A connection to be used as a context manager.
+    :rtype: sqlalchemy.engine.Connection
+    """
+    monitor, started = pool_monitor, time.perf_counter()
+    try:
+        connection = conn.engine.connect()
+    except exc.TimeoutError:
+        with monitor['lock']:
+            monitor['timeouts'] += 1
+        raise
+
+    wait = time.perf_counter() - started
+    with monitor['lock']:
+        monitor['waits'] += 1
+        monitor['wait_total'] += wait
+        monitor['wait_max'] = max(monitor['wait_max'], wait)
+
+    return connection
+
+
+def get_pool_stats():
+    """
+    Returns the current pool statistics, i.e. to size the pool against the number of sessions per replica.
+
+    :return: A dictionary with the configured pool size, the currently checked out & overflow connections,
+        the number of checkouts (total, while in overflow, timed out) and the average/maximum checkout wait in ms.
+    :rtype: dict
+    """
+    pool, monitor = conn.engine.pool, pool_monitor
+    with monitor['lock']:
+        return dict(pool_size=pool.size(), checked_out=pool.checkedout(), overflow=max(pool.overflow(), 0), checkouts=monitor['checkouts'], overflow_checkouts=monitor['overflow_checkouts'], timeouts=monitor['timeouts'], wait_avg_ms=1000 * monitor['wait_total'] / monitor['waits'] if monitor['waits'] else 0.0, wait_max_ms=1000 * monitor['wait_max'])
+
+
+# Module-level reference, so background threads don't need the Streamlit runtime to reach the statistics
+pool_monitor = get_pool_monitor()
+
+
+class DatabaseUnavailableError(Exception):
+    """
+    Raised by a guarded read (see guarded_read) that failed or was skipped by the open circuit breaker
+    and has no earlier result to serve instead.
+    """
+
+
+@st.cache_resource()
+def get_circuit_breaker():
+    """
+    Holds the state of the circuit breaker of the reads (one per process): the consecutive failures, the time
+    the breaker opened (None while closed), whether a probing read is running and the last results of the
+    guarded calls (key -> (loaded at, result)) in least recently used order.
+
+    :return: The mutable circuit breaker state.
+    :rtype: dict
+    """
+    return dict(lock=threading.Lock(), failures=0, opened_at=None, probing=False, results=OrderedDict())
+
+
+# Module-level reference, so reads in background threads update the same breaker
+circuit_breaker = get_circuit_breaker()
+
+
+def record_success(breaker: dict):
+    """
+    Closes the circuit breaker after a successful query.
+
+    :param breaker: The circuit breaker state as returned by get_circuit_breaker.
+    :type breaker: dict
+    :return: None
+    """
+    if breaker['failures'] or breaker['opened_at'] is not None:
+        with breaker['lock']:
+            breaker.update(failures=0, opened_at=None)
+
+
+def record_failure(breaker: dict):
+    """
+    Counts a failed read, the circuit breaker opens after DB_BREAKER_FAILURES consecutive failures.
+
+    :param breaker: The circuit breaker state as returned by get_circuit_breaker.
+    :type breaker: dict
+    :return: None
+    """
+    with breaker['lock']:
+        breaker['failures'] += 1
+        if breaker['failures'] >= DB_BREAKER_FAILURES:
+            if breaker['opened_at'] is None:
+                logger.error('Circuit breaker opened after %d failed reads, serving last results for %s seconds', breaker['failures'], DB_BREAKER_COOLDOWN)
+            breaker['opened_at'] = time.time()
+
+
+def allow_read(breaker: dict):
+    """
+    :param breaker: The circuit breaker state as returned by get_circuit_breaker.
+    :type breaker: dict
+    :return: A tuple of True if the read may query the database (the breaker is closed, or it is the one probing
+        read after DB_BREAKER_COOLDOWN seconds) and True if it is the probing read.
+    :rtype: tuple[bool, bool]
     """
-    return conn.query(f"SELECT league_id, league_name FROM {TABLE_LEAGUES} WHERE sport_id = {sport_id}")
+    with breaker['lock']:
+        if breaker['opened_at'] is None:
+            return True, False
+        if breaker['probing'] or time.time() - breaker['opened_at'] < DB_BREAKER_COOLDOWN:
+            return False, False
+        breaker['probing'] = True
+        return True, True
+
+
+# Set while a guarded read runs with the circuit breaker open: the caches of the read still answer, database reads raise (see check_cache_only)
+cache_only_reads = threading.local()
 
 
-@st.cache_data()
-def get_fixtures(sport_id: int, date_from: datetime, date_to: datetime):
+def check_cache_only():
     """
-    Fetches distinct fixtures for a specific sport within a given date range, optionally filtering
-    for the availability of odds. The fixtures are retrieved from the database and include
-    details such as the event ID, league ID, league name, start time, and runners (home and away teams).
-    The results are ordered by the event start time.
+    Raises DatabaseUnavailableError instead of querying the database while a guarded read runs with the circuit
+    breaker open (see guarded_read), so only the caches of the read (st.cache_data, single_flight_cache, odds cache) answer.
 
-    :param sport_id: The ID of the sport for which to fetch fixtures.
+    :return: None
+    """
+    if getattr(cache_only_reads, 'active', False):
+        raise DatabaseUnavailableError('the database is unavailable, only cached results are served')
+
+
+# The stale marks of a read running on a worker thread of run_concurrently, applied on the script thread after the join
+concurrent_reads = threading.local()
+
+
+def mark_stale(loaded_at: float):
+    """
+    Marks the data shown in the current script run as stale, the app displays the time of the oldest stale result.
+    On worker threads of run_concurrently the mark is collected and applied by the script thread. Does nothing
+    outside of a Streamlit script run (i.e. in background threads).
+
+    :param loaded_at: The time the stale result was loaded.
+    :type loaded_at: float
+    :return: None
+    """
+    stale_marks = getattr(concurrent_reads, 'stale_marks', None)
+    if stale_marks is not None:
+        stale_marks.append(loaded_at)
+    elif get_script_run_ctx(suppress_warning=True) is not None:
+        st.session_state.stale_since = min(st.session_state.get('stale_since') or loaded_at, loaded_at)
+
+
+def guarded_read(fallback: bool = True):
+    """
+    Protects a read function with the circuit breaker. While the database is unhealthy (connection & pool errors,
+    statement timeouts), the last result of a call with the same arguments is served instead and marked as stale
+    (see mark_stale), so a struggling database doesn't block every page load:
+
+    - A failing read counts towards the breaker and serves the last result.
+    - While the breaker is open, reads don't query the database: the caches of the read function answer if they
+      can (see check_cache_only), else the last result is served right away.
+
+    Without a last result DatabaseUnavailableError is raised. The last results are shared by all sessions and must not be modified.
+
+    :param fallback: False for reads whose earlier results are useless later on (they are still skipped while the breaker is open).
+    :type fallback: bool
+    :return: The decorator.
+    """
+    def decorator(function):
+
+        def serve_last(key: tuple, ex: Exception = None):
+            with circuit_breaker['lock']:
+                entry = circuit_breaker['results'].get(key)
+            if entry is None:
+                raise DatabaseUnavailableError(f'{function.__name__}: the database is unavailable') from ex
+            mark_stale(entry[0])
+            return entry[1].copy() if isinstance(entry[1], pd.DataFrame) else entry[1]
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = (function.__qualname__, args, tuple(sorted(kwargs.items())))
+            allowed, probing = allow_read(circuit_breaker)
+            if not allowed:
+                cache_only_reads.active = True
+                try:
+                    return function(*args, **kwargs)
+                except DatabaseUnavailableError as ex:
+                    return serve_last(key, ex)
+                finally:
+                    cache_only_reads.active = False
+
+            try:
+                result = function(*args, **kwargs)
+            except DatabaseUnavailableError as ex:
+                # Waited for a shared query (single_flight_cache, odds cache) of a read that was served from the caches only
+                return serve_last(key, ex)
+            except (exc.OperationalError, exc.InternalError, exc.TimeoutError) as ex:
+                record_failure(circuit_breaker)
+                logger.warning('%s failed, serving the last result: %s', function.__name__, ex)
+                return serve_last(key, ex)
+            except exc.DatabaseError as ex:
+                # Statement timeouts are raised as plain DatabaseError by the driver, programming errors are bugs and re-raised
+                if type(ex) is not exc.DatabaseError:
+                    raise
+                record_failure(circuit_breaker)
+                logger.warning('%s failed, serving the last result: %s', function.__name__, ex)
+                return serve_last(key, ex)
+            finally:
+                if probing:
+                    with circuit_breaker['lock']:
+                        circuit_breaker['probing'] = False
+
+            if fallback:
+                with circuit_breaker['lock']:
+                    circuit_breaker['results'][key] = (time.time(), result)
+                    circuit_breaker['results'].move_to_end(key)
+                    while len(circuit_breaker['results']) > DB_FALLBACK_MAX_ENTRIES:
+                        circuit_breaker['results'].popitem(last=False)
+
+            return result
+
+        return wrapper
+
+    return decorator
+
+# The indexes these statements rely on are created by the migrations in schema.py, 'python schema.py check' verifies the query plans.
+# All reads and batch writes are fixed, parameterized statements built once at import time. The statement text never changes between
+# calls, so SQLAlchemy's compiled cache can reuse them and MySQL sees a bounded set of statements instead of one new text per call.
+# Filters on lists of values (sports, bookmakers, tags, bet status) use expanding IN-parameters, the bets filters are encoded compactly (see get_bets_statement).
+# Date filters are half-open ranges of storage time on the bare starts column (starts >= :starts_from AND starts < :starts_to),
+# computed from the user's local dates by tools.get_storage_range, so they are index range scans.
+# "Has odds" is a semi-join (EXISTS stops at the first odds line of an event), so fixtures are returned once per event without materializing every odds line
+# Fixture search: the (sport_id, starts) range bounds the scan, matches are ranked by team/player name prefix, then by start
+QUERY_SEARCH_FIXTURES = text(f"SELECT f.event_id, f.league_id, f.league_name, f.starts, f.runner_home, f.runner_away FROM {TABLE_FIXTURES} f WHERE f.sport_id = :sport_id AND f.starts >= :starts_from AND f.starts < :starts_to AND CONCAT_WS(' ', f.league_name, f.runner_home, f.runner_away) LIKE :contains AND EXISTS (SELECT 1 FROM {TABLE_ODDS} o WHERE o.event_id = f.event_id) ORDER BY (f.runner_home LIKE :prefix OR f.runner_away LIKE :prefix) DESC, f.league_name LIKE :prefix DESC, f.starts LIMIT :limit")
+BETS_SELECTED_COLUMNS = "delete_bet, id, tag, starts, sport_name, league_name, runner_home, runner_away, market, period_name, side_name, line, odds, stake, bookmaker, bet_status, score_home, score_away, profit, cls_odds, true_cls, cls_limit, ev, clv, bet_added, idempotency_key"
+# Explicit schema of the bets dataframes: categoricals for low-cardinality text, float32 for odds & clv
+BETS_DTYPES = {'delete_bet': 'bool', 'sport_name': 'category', 'league_name': 'category', 'market': 'category', 'period_name': 'category', 'side_name': 'category', 'bookmaker': 'category', 'bet_status': 'category', 'odds': 'float32', 'cls_odds': 'float32', 'true_cls': 'float32', 'clv': 'float32', 'starts': 'datetime64[ns]', 'bet_added': 'datetime64[ns]'}
+# Bets filters: the list filters are only sent if they narrow the result. Every list filter is either omitted (everything selected),
+# an expanding IN or NOT IN parameter (whichever list is shorter) or, for very large lists, a semi-join on a temporary table (see read)
+BETS_LIST_FILTERS = (('sports', 'sport_name'), ('bookmakers', 'bookmaker'), ('tags', 'tag'), ('bet_status', 'bet_status'))
+BETS_FILTER = "user = :username AND delete_bet = 0 AND starts >= :starts_from AND starts < :starts_to{list_filters}"
+BETS_QUERIES = dict(
+    # Keyset paging: the next page starts right after the (starts, id) of the last bet of the previous page
+    page=f"SELECT {BETS_SELECTED_COLUMNS} FROM {TABLE_BETS} WHERE {BETS_FILTER} AND (starts > :after_starts OR (starts = :after_starts AND id > :after_id)) ORDER BY starts, id LIMIT :limit",
+    performance=f"SELECT profit, ev FROM {TABLE_BETS} WHERE {BETS_FILTER} AND bet_status <> 'na' ORDER BY starts, id",
+    # Headline stats: bets & turnover count graded bets only, the stake-weighted odds, profit & ev include all filtered bets
+    summary=f"SELECT COALESCE(SUM(bet_status <> 'na'), 0) AS bets, COALESCE(SUM(CASE WHEN bet_status <> 'na' THEN stake ELSE 0 END), 0) AS turnover, COALESCE(SUM(stake), 0) AS sum_stake, COALESCE(SUM(odds * stake), 0) AS sum_odds_stake, COALESCE(SUM(profit), 0) AS sum_profit, COALESCE(SUM(ev), 0) AS sum_ev FROM {TABLE_BETS} WHERE {BETS_FILTER}",
+)
+# Temporary filter tables (create, fill, drop) per list filter. The value column is copied from bets, so types & collations match
+FILTER_TABLES = {name: (text(f"CREATE TEMPORARY TABLE filter_{name} (PRIMARY KEY (value)) SELECT {column} AS value FROM {TABLE_BETS} LIMIT 0"), text(f"INSERT INTO filter_{name} (value) VALUES (:value)"), text(f"DROP TEMPORARY TABLE IF EXISTS filter_{name}")) for name, column in BETS_LIST_FILTERS}
+# The (event_id, market, period) keys of imported bets, so only the odds lines of these markets are read (see get_odds_by_import_keys)
+FILTER_TABLES['import_keys'] = (text(f"CREATE TEMPORARY TABLE filter_import_keys (PRIMARY KEY (event_id, market, period)) SELECT event_id, market, period FROM {TABLE_ODDS} LIMIT 0"), text("INSERT INTO filter_import_keys (event_id, market, period) VALUES (:event_id, :market, :period)"), text("DROP TEMPORARY TABLE IF EXISTS filter_import_keys"))
+
+
+@functools.lru_cache(maxsize=None)
+def get_bets_statement(query: str, shape: tuple):
+    """
+    Builds the statement of a bets query for one shape of the list filters. There are few shapes, every shape is
+    built once and reused, so the set of statements stays bounded.
+
+    :param query: The bets query, one of the keys of BETS_QUERIES ('page', 'performance', 'summary').
+    :type query: str
+    :param shape: Per list filter (sports, bookmakers, tags, bet_status) None if omitted, else a tuple of the
+        operator ('IN' or 'NOT IN') and True if the values are read from the temporary filter table.
+    :type shape: tuple
+    :return: The statement.
+    :rtype: sqlalchemy.sql.elements.TextClause
+    """
+    predicates, expanding = list(), list()
+    for (name, column), encoding in zip(BETS_LIST_FILTERS, shape):
+        if encoding is None:
+            continue
+        operator, from_table = encoding
+        if from_table:
+            predicates.append(f" AND {column} {operator} (SELECT value FROM filter_{name})")
+        else:
+            predicates.append(f" AND {column} {operator} :{name}")
+            expanding.append(bindparam(name, expanding=True))
+
+    return text(BETS_QUERIES[query].format(list_filters=''.join(predicates))).bindparams(*expanding)
+
+
+# The bets queries with IN lists for all list filters, i.e. for the query plan check of schema.py
+QUERY_BETS_PAGE = get_bets_statement('page', (('IN', False),) * len(BETS_LIST_FILTERS))
+QUERY_BETS_PERFORMANCE = get_bets_statement('performance', (('IN', False),) * len(BETS_LIST_FILTERS))
+QUERY_BET_SUMMARY = get_bets_statement('summary', (('IN', False),) * len(BETS_LIST_FILTERS))
+# Delta polls: bets.updated_at (schema.py, migration 1) is maintained by MySQL on every insert & update (also by the grader), deleted bets are returned with delete_bet = 1
+QUERY_BETS_CHANGED_SINCE = text(f"SELECT {BETS_SELECTED_COLUMNS}, updated_at FROM {TABLE_BETS} WHERE user = :username AND updated_at > :since ORDER BY updated_at, id")
+QUERY_BETS_SYNC_POINT = text(f"SELECT MAX(updated_at) AS updated_at FROM {TABLE_BETS} WHERE user = :username")
+QUERY_FIXTURES_BY_EVENT_IDS = text(f"SELECT event_id, sport_id, league_id, league_name, starts, runner_home, runner_away FROM {TABLE_FIXTURES} WHERE event_id IN :event_ids").bindparams(bindparam('event_ids', expanding=True))
+QUERY_ODDS_BY_IMPORT_KEYS = text(f"SELECT o.event_id, o.period, o.market, o.line, o.odds1, o.odds0, o.odds2 FROM {TABLE_ODDS} o JOIN filter_import_keys ON filter_import_keys.event_id = o.event_id AND filter_import_keys.market = o.market AND filter_import_keys.period = o.period")
+QUERY_ODDS_BY_EVENT_IDS = text(f"SELECT event_id, period, market, line, odds1, odds0, odds2 FROM {TABLE_ODDS} WHERE event_id IN :event_ids").bindparams(bindparam('event_ids', expanding=True))
+QUERY_USER_FACETS = text(f"SELECT sport_name, bookmaker, tag, bet_status, COUNT(*) AS bets, MIN(starts) AS starts_min, MAX(starts) AS starts_max FROM {TABLE_BETS} WHERE user = :username AND delete_bet = 0 GROUP BY sport_name, bookmaker, tag, bet_status")
+QUERY_USER_PROFILE = text(f"SELECT odds_display, timezone, default_sport, default_book, default_tag FROM {TABLE_USERS} WHERE username = :username")
+BET_COLUMNS = ('user', 'tag', 'starts', 'sport_id', 'sport_name', 'league_id', 'league_name', 'event_id', 'runner_home', 'runner_away', 'market', 'period', 'period_name', 'side', 'side_name', 'raw_line', 'line', 'odds', 'stake', 'bookmaker', 'bet_status', 'score_home', 'score_away', 'profit', 'cls_odds', 'true_cls', 'cls_limit', 'ev', 'clv', 'bet_added', 'idempotency_key')
+# A bet submitted twice (double click, retried batch) has the same idempotency key, the unique index turns the second insert into a no-op
+QUERY_INSERT_BET_IDEMPOTENT = text(f"INSERT INTO {TABLE_BETS} ({', '.join(BET_COLUMNS)}) VALUES({', '.join(f':{column}' for column in BET_COLUMNS)}) ON DUPLICATE KEY UPDATE id = id")
+QUERY_UPDATE_BET = {column_name: text(f"UPDATE {TABLE_BETS} SET {column_name} = :value, user_edit = :user_edit WHERE id = :id AND user = :username") for column_name in ('tag', 'bookmaker', 'bet_status', 'score_home', 'score_away', 'profit')}
+QUERY_DELETE_BETS = text(f"UPDATE {TABLE_BETS} SET delete_bet = 1, user_edit = :user_edit WHERE user = :username AND id IN :ids").bindparams(bindparam('ids', expanding=True))
+QUERY_PURGE_DELETED_BETS = text(f"DELETE FROM {TABLE_BETS} WHERE delete_bet = 1 AND updated_at < NOW() - INTERVAL :retention SECOND LIMIT :batch_size")
+QUERY_UPDATE_USER_SETTING = {column_name: text(f"UPDATE {TABLE_USERS} SET {column_name} = :value WHERE username = :username") for column_name in ('odds_display', 'timezone', 'default_sport', 'default_book', 'default_tag')}
+# Statement timeout of the SELECTs of a session (see read_on). Not a QUERY_* constant, schema.py only EXPLAINs queries
+SET_STATEMENT_TIMEOUT = text("SET SESSION max_execution_time = :milliseconds")
+# Concurrent first logins of a user insert once: the second insert hits the unique username index (schema.py, migration 2) and is a no-op
+QUERY_INSERT_USER_IF_ABSENT = text(f"INSERT INTO {TABLE_USERS} (username, odds_display, timezone, default_sport, default_book, default_tag) SELECT :username, :odds_display, :timezone, :default_sport, :default_book, :default_tag FROM DUAL WHERE NOT EXISTS (SELECT 1 FROM {TABLE_USERS} WHERE username = :username) ON DUPLICATE KEY UPDATE username = username")
+
+
+def read(statement, filter_tables: dict = None, timeout: float = DB_STATEMENT_TIMEOUT, **params):
+    """
+    Executes a prepared read statement on a pooled connection and returns the result as a dataframe.
+
+    The statement is one of the module-level QUERY_* constants. Values are always passed as bound parameters
+    and never formatted into the statement text. Lists/tuples are accepted for expanding IN-parameters.
+
+    :param statement: The parameterized statement to be executed.
+    :type statement: sqlalchemy.sql.elements.TextClause
+    :param filter_tables: Values of the temporary filter tables used by the statement (see FILTER_TABLES), list filter name -> values
+        (parameter dictionaries for tables with several columns).
+    :type filter_tables: dict[str, tuple]
+    :param timeout: The statement timeout in seconds (see read_on).
+    :type timeout: float
+    :param params: The values for the bound parameters of the statement.
+    :return: The query result.
+    :rtype: pd.DataFrame
+    """
+    check_cache_only()
+    with connect() as connection:
+        return read_on(connection, statement, filter_tables, params, timeout)
+
+
+def read_on(connection, statement, filter_tables: dict, params: dict, timeout: float = DB_STATEMENT_TIMEOUT):
+    """
+    Executes a read statement on an open connection. The temporary filter tables are created & filled on this
+    connection before and dropped after the query, so the pooled connection is returned clean.
+
+    The statement timeout is set as max_execution_time of the MySQL session, so the server aborts the query instead
+    of blocking the calling thread indefinitely. It only applies to SELECTs and is only sent when it differs from the
+    timeout last set on this (pooled) connection. A successful query closes the circuit breaker (see guarded_read).
+
+    :param connection: An open connection.
+    :param statement: The parameterized statement to be executed.
+    :type statement: sqlalchemy.sql.elements.TextClause
+    :param filter_tables: List filter name -> values of the temporary filter tables, None if the statement uses none.
+    :type filter_tables: dict[str, tuple] | None
+    :param params: The values for the bound parameters of the statement.
+    :type params: dict
+    :param timeout: The statement timeout in seconds.
+    :type timeout: float
+    :return: The query result.
+    :rtype: pd.DataFrame
+    """
+    milliseconds = int(timeout * 1000)
+    if connection.info.get('max_execution_time') != milliseconds:
+        connection.execute(SET_STATEMENT_TIMEOUT, dict(milliseconds=milliseconds))
+        connection.info['max_execution_time'] = milliseconds
+
+    filter_tables = filter_tables or dict()
+    for name, values in filter_tables.items():
+        create_table, fill_table, drop_table = FILTER_TABLES[name]
+        connection.execute(drop_table)
+        connection.execute(create_table)
+        if values:
+            connection.execute(fill_table, [value if isinstance(value, dict) else dict(value=value) for value in values])
+
+    try:
+        result = pd.read_sql(statement, connection, params=params)
+    finally:
+        for name in filter_tables:
+            connection.execute(FILTER_TABLES[name][2])
+
+    record_success(circuit_breaker)
+    return result
+
+
+def read_replica(statement, filter_tables: dict = None, timeout: float = DB_STATEMENT_TIMEOUT, **params):
+    """
+    Executes a prepared read statement on one of the read replicas (round robin) and returns the result as a
+    dataframe. Falls back to the primary if there are no replicas or the replica is unreachable.
+
+    With DB_HEDGE_DELAY set, a read still running after DB_HEDGE_DELAY seconds is also sent to a second source
+    (the next replica, or the primary if there is only one replica) and the first result wins. The slower query is
+    left running, its statement timeout bounds it.
+
+    Only for reads that tolerate replication lag, i.e. shared reference data (fixtures, odds).
+
+    :param statement: The parameterized statement to be executed.
+    :type statement: sqlalchemy.sql.elements.TextClause
+    :param filter_tables: Values of the temporary filter tables used by the statement (see read).
+    :type filter_tables: dict[str, tuple]
+    :param timeout: The statement timeout in seconds (see read_on).
+    :type timeout: float
+    :param params: The values for the bound parameters of the statement.
+    :return: The query result.
+    :rtype: pd.DataFrame
+    """
+    if not replicas:
+        return read(statement, filter_tables, timeout, **params)
+
+    check_cache_only()
+    first = next(replica_counter) % len(replicas)
+    replica, hedge = replicas[first], replicas[(first + 1) % len(replicas)] if len(replicas) > 1 else None
+
+    if DB_HEDGE_DELAY is not None:
+        return read_hedged((replica, hedge), statement, filter_tables, timeout, params)
+
+    try:
+        return read_source(replica, statement, filter_tables, timeout, params)
+    except exc.OperationalError as ex:
+        logger.warning('Reading from the replica failed, reading from the primary: %s', ex)
+
+    return read(statement, filter_tables, timeout, **params)
+
+
+def read_source(source, statement, filter_tables: dict, timeout: float, params: dict):
+    """
+    Executes a read statement on a read replica or on the primary.
+
+    :param source: A read replica (see replicas), None for the primary.
+    :type source: SQLConnection | None
+    :param statement: The parameterized statement to be executed.
+    :type statement: sqlalchemy.sql.elements.TextClause
+    :param filter_tables: Values of the temporary filter tables used by the statement (see read).
+    :type filter_tables: dict[str, tuple]
+    :param timeout: The statement timeout in seconds (see read_on).
+    :type timeout: float
+    :param params: The values for the bound parameters of the statement.
+    :type params: dict
+    :return: The query result.
+    :rtype: pd.DataFrame
+    """
+    if source is None:
+        return read(statement, filter_tables, timeout, **params)
+
+    with source.engine.connect() as connection:
+        return read_on(connection, statement, filter_tables, params, timeout)
+
+
+@st.cache_resource()
+def get_hedge_executor():
+    """
+    :return: The thread pool running hedged reads (one per process, shared by all sessions).
+    :rtype: ThreadPoolExecutor
+    """
+    return ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix='hedged_read')
+
+
+def read_hedged(sources: tuple, statement, filter_tables: dict, timeout: float, params: dict):
+    """
+    Executes a read statement on the first source. If it didn't return after DB_HEDGE_DELAY seconds (or failed),
+    the read is also sent to the second source. Returns the first successful result, raises if both reads failed.
+
+    :param sources: The first and the second source (see read_source).
+    :type sources: tuple
+    :param statement: The parameterized statement to be executed.
+    :type statement: sqlalchemy.sql.elements.TextClause
+    :param filter_tables: Values of the temporary filter tables used by the statement (see read).
+    :type filter_tables: dict[str, tuple]
+    :param timeout: The statement timeout in seconds (see read_on).
+    :type timeout: float
+    :param params: The values for the bound parameters of the statement.
+    :type params: dict
+    :return: The query result.
+    :rtype: pd.DataFrame
+    """
+    executor = get_hedge_executor()
+    futures = [executor.submit(read_source, sources[0], statement, filter_tables, timeout, params)]
+
+    done, pending = wait(futures, timeout=DB_HEDGE_DELAY)
+    if pending or futures[0].exception() is not None:
+        futures.append(executor.submit(read_source, sources[1], statement, filter_tables, timeout, params))
+
+    error = None
+    for future in as_completed(futures):
+        if future.exception() is None:
+            return future.result()
+        error = future.exception()
+
+    raise error
+
+
+def read_bets(statement, bets_version: int, filter_tables: dict = None, timeout: float = DB_STATEMENT_TIMEOUT, **params):
+    """
+    Executes a read statement on the bets of a user. The bets version stamp of the user (see get_bets_versions)
+    is the time of the user's last write (or of the first read in this process): within DB_REPLICA_MAX_LAG seconds after a write the bets are read from
+    the primary, so users always see their own writes. Later on they are read from a replica.
+
+    :param statement: The parameterized statement to be executed.
+    :type statement: sqlalchemy.sql.elements.TextClause
+    :param bets_version: The bets version stamp of the user.
+    :type bets_version: int
+    :param filter_tables: Values of the temporary filter tables used by the statement (see read).
+    :type filter_tables: dict[str, tuple]
+    :param timeout: The statement timeout in seconds (see read_on).
+    :type timeout: float
+    :param params: The values for the bound parameters of the statement.
+    :return: The query result.
+    :rtype: pd.DataFrame
+    """
+    if time.time_ns() - bets_version < DB_REPLICA_MAX_LAG * 1_000_000_000:
+        return read(statement, filter_tables, timeout, **params)
+    return read_replica(statement, filter_tables, timeout, **params)
+
+
+def read_filtered_bets(query: str, bets_version: int, sports: tuple, bookmakers: tuple, tags: tuple, bet_status: tuple, timeout: float = DB_STATEMENT_TIMEOUT, **params):
+    """
+    Executes a bets query (see BETS_QUERIES) with encoded list filters (see tools.encode_filter). Lists of more
+    than BETS_FILTER_TABLE_MIN_VALUES values are sent through temporary filter tables instead of IN lists.
+
+    :param query: The bets query, one of the keys of BETS_QUERIES.
+    :type query: str
+    :param bets_version: The bets version stamp of the user (see read_bets).
+    :type bets_version: int
+    :param sports: The encoded sports filter.
+    :type sports: tuple | None
+    :param bookmakers: The encoded bookmakers filter.
+    :type bookmakers: tuple | None
+    :param tags: The encoded tags filter.
+    :type tags: tuple | None
+    :param bet_status: The encoded bet status filter.
+    :type bet_status: tuple | None
+    :param timeout: The statement timeout in seconds (see read_on).
+    :type timeout: float
+    :param params: The values for the other bound parameters of the query.
+    :return: The query result.
+    :rtype: pd.DataFrame
+    """
+    shape, filter_params, filter_tables = list(), dict(), dict()
+    for (name, column), encoded in zip(BETS_LIST_FILTERS, (sports, bookmakers, tags, bet_status)):
+        if encoded is None:
+            shape.append(None)
+        elif len(encoded[1]) > BETS_FILTER_TABLE_MIN_VALUES:
+            shape.append((encoded[0], True))
+            filter_tables[name] = encoded[1]
+        else:
+            shape.append((encoded[0], False))
+            filter_params[name] = encoded[1]
+
+    return read_bets(get_bets_statement(query, tuple(shape)), bets_version, filter_tables, timeout, **filter_params, **params)
+
+
+def read_chunked(statement, chunk_param: str, values: list, chunk_size: int, timeout: float = DB_STATEMENT_TIMEOUT, **params):
+    """
+    Executes a read statement with an expanding IN-parameter in chunks of chunk_size values and concatenates the results.
+    Used for reference data only, so the chunks are read from the replicas (see read_replica).
+
+    :param statement: The parameterized statement to be executed.
+    :type statement: sqlalchemy.sql.elements.TextClause
+    :param chunk_param: The name of the expanding IN-parameter.
+    :type chunk_param: str
+    :param values: The values for the expanding IN-parameter.
+    :type values: list
+    :param chunk_size: The maximum number of values per query.
+    :type chunk_size: int
+    :param timeout: The statement timeout of every chunk in seconds (see read_on).
+    :type timeout: float
+    :param params: The values for the other bound parameters of the statement.
+    :return: The concatenated query results.
+    :rtype: pd.DataFrame
+    """
+    # An empty list still runs one query, so the (empty) result has the proper columns
+    return pd.concat([read_replica(statement, None, timeout, **{chunk_param: values[start:start + chunk_size]}, **params) for start in range(0, max(len(values), 1), chunk_size)], ignore_index=True)
+
+
+@st.cache_resource()
+def get_query_executor():
+    """
+    :return: The thread pool running independent queries concurrently (one per process, shared by all sessions).
+    :rtype: ThreadPoolExecutor
+    """
+    return ThreadPoolExecutor(max_workers=DB_QUERY_WORKERS, thread_name_prefix='query')
+
+
+def run_concurrently(**calls: tuple):
+    """
+    Runs independent db functions concurrently on the query thread pool (each on its own pooled connection)
+    and waits for all of them. The latency is set by the slowest call instead of the sum of all calls.
+
+    The Streamlit script run context is attached to the worker threads, so cached functions work as usual. The
+    calls must not write the session state or show elements (the cached functions run here have show_spinner=False),
+    they return plain values. Stale marks of the calls (see mark_stale) are applied on the script thread after the join.
+
+    Example: db.run_concurrently(facets=(db.get_user_facets, dict(username=username)), events=(db.search_fixtures, dict(...)))
+
+    :param calls: Name -> (function, keyword arguments) of the calls to be run.
+    :return: A dictionary mapping the names to the results of the calls. Exceptions are re-raised.
+    :rtype: dict
+    """
+    ctx = get_script_run_ctx()
+
+    def call_with_context(function, kwargs, stale_marks):
+        add_script_run_ctx(threading.current_thread(), ctx)
+        concurrent_reads.stale_marks = stale_marks
+        try:
+            return function(**kwargs)
+        finally:
+            concurrent_reads.stale_marks = None
+
+    stale_marks = {name: list() for name in calls}
+    futures = {name: get_query_executor().submit(call_with_context, function, kwargs, stale_marks[name]) for name, (function, kwargs) in calls.items()}
+    try:
+        return {name: future.result() for name, future in futures.items()}
+    finally:
+        for loaded_at in (loaded_at for marks in stale_marks.values() for loaded_at in marks):
+            mark_stale(loaded_at=loaded_at)
+
+
+@st.cache_resource()
+def get_refresh_executor():
+    """
+    :return: The background thread pool recomputing stale reference data (one per process).
+    :rtype: ThreadPoolExecutor
+    """
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix='refresh')
+
+
+@st.cache_resource()
+def get_flight_cache(name: str):
+    """
+    Holds the cached results of one single_flight_cache function for all sessions of this process.
+
+    :param name: The name of the cached function.
+    :type name: str
+    :return: The cache state: a lock, the values (key -> (computed at, value)) in least recently used order and the in-flight computations (key -> future).
+    :rtype: dict
+    """
+    return dict(lock=threading.Lock(), values=OrderedDict(), inflight=dict())
+
+
+def single_flight_cache(ttl: float, stale_ttl: float = 0, max_entries: int = None):
+    """
+    Caches a reference data function for all sessions of this process, like st.cache_data(ttl=ttl), and protects
+    the database from cache stampedes:
+
+    - Single flight: concurrent calls with the same arguments share one in-flight query instead of running it once per session.
+    - Stale while revalidate: for stale_ttl seconds after expiry the stale value is returned right away and a single
+      background query recomputes it, so an expiring hot key never fans out to the database.
+
+    The cached values are shared by all callers and must not be modified.
+
+    :param ttl: The number of seconds a value is fresh.
+    :type ttl: float
+    :param stale_ttl: The number of seconds after expiry a stale value is still served.
+    :type stale_ttl: float
+    :param max_entries: The maximum number of cached values, the least recently used are dropped. None for no limit.
+    :type max_entries: int
+    :return: The decorator.
+    """
+    def decorator(function):
+
+        def compute(flight_cache: dict, key: tuple, future: Future, args: tuple, kwargs: dict):
+            try:
+                value = function(*args, **kwargs)
+            except Exception as ex:
+                future.set_exception(ex)
+            else:
+                with flight_cache['lock']:
+                    flight_cache['values'][key] = (time.time(), value)
+                    flight_cache['values'].move_to_end(key)
+                    while max_entries is not None and len(flight_cache['values']) > max_entries:
+                        flight_cache['values'].popitem(last=False)
+                future.set_result(value)
+            finally:
+                with flight_cache['lock']:
+                    flight_cache['inflight'].pop(key, None)
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            flight_cache, key, now = get_flight_cache(function.__qualname__), (args, tuple(sorted(kwargs.items()))), time.time()
+
+            with flight_cache['lock']:
+                entry = flight_cache['values'].get(key)
+                if entry is not None:
+                    flight_cache['values'].move_to_end(key)
+                    if now - entry[0] < ttl:
+                        return entry[1]
+                future, owner = flight_cache['inflight'].get(key), False
+                if future is None:
+                    future, owner = Future(), True
+                    flight_cache['inflight'][key] = future
+
+            if entry is not None and now - entry[0] < ttl + stale_ttl:
+                if owner:
+                    get_refresh_executor().submit(compute, flight_cache, key, future, args, kwargs)
+                return entry[1]
+
+            if owner:
+                compute(flight_cache, key, future, args, kwargs)
+            return future.result()
+
+        return wrapper
+
+    return decorator
+
+
+@guarded_read()
+@single_flight_cache(ttl=FIXTURES_CACHE_TTL, stale_ttl=FIXTURES_STALE_TTL, max_entries=1000)
+def search_fixtures(sport_id: int, search: str, starts_from: datetime, starts_to: datetime, limit: int = FIXTURES_SEARCH_LIMIT):
+    """
+    Searches fixtures with available odds by league, home and away team/player within a range of starts.
+
+    All words of the search string must appear (in this order) in the concatenated league and runner
+    names. Fixtures where a runner name starts with the first word are ranked first. At most limit
+    fixtures are returned.
+
+    The matching runs on every fixture of the range before the limit applies, so the range is cut to
+    FIXTURES_SEARCH_MAX_DAYS calendar days, or to FIXTURES_BROWSE_MAX_DAYS calendar days for an empty search (the app asks for a search then).
+
+    :param sport_id: The ID of the sport for which to search fixtures.
     :type sport_id: int
-    :param date_from: The start date and time for the range within which to fetch the fixtures.
-    :param date_to: The end date and time for the range within which to fetch the fixtures.
-    :return: Query results containing the details of fixtures (event ID, league details, start time,
-             and team runners).
-    :rtype: Any
+    :param search: The search string, i.e. 'premier arsenal'. An empty string matches all fixtures.
+    :type search: str
+    :param starts_from: The start of the half-open search window (storage time, see tools.get_storage_range).
+    :type starts_from: datetime
+    :param starts_to: The end of the half-open search window (storage time, excluded).
+    :type starts_to: datetime
+    :param limit: The maximum number of fixtures returned.
+    :type limit: int
+    :return: A dataframe with the columns event_id, league_id, league_name, starts, runner_home and runner_away.
+    :rtype: pd.DataFrame
     """
-    # This query returns the fixtures including if odds and results are actually available
-    #return conn.query(f"SELECT DISTINCT(f.event_id), f.league_id, f.league_name, f.starts, f.runner_home, f.runner_away FROM {TABLE_FIXTURES} f, {TABLE_ODDS} o, {TABLE_RESULTS} r WHERE o.event_id = f.event_id AND r.event_id = f.event_id AND f.sport_id = {sport_id} AND f.starts >= '{date_from.strftime('%Y-%m-%d %H:%M:%S')}' AND f.starts < DATE_ADD('{date_to.strftime('%Y-%m-%d %H:%M:%S')}', INTERVAL 1 DAY) ORDER BY f.starts")
-    return conn.query(f"SELECT DISTINCT(f.event_id), f.league_id, f.league_name, f.starts, f.runner_home, f.runner_away FROM {TABLE_FIXTURES} f, {TABLE_ODDS} o WHERE o.event_id = f.event_id AND f.sport_id = {sport_id} AND f.starts >= '{date_from.strftime('%Y-%m-%d %H:%M:%S')}' AND f.starts < DATE_ADD('{date_to.strftime('%Y-%m-%d %H:%M:%S')}', INTERVAL 1 DAY) ORDER BY f.starts")
+    words = [word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') for word in search.split()]
+    contains = '%' + '%'.join(words) + '%' if words else '%'
+    prefix = words[0] + '%' if words else '%'
+    # A range of local calendar days may be an hour longer in storage time across a DST change
+    starts_to = min(starts_to, starts_from + timedelta(days=FIXTURES_SEARCH_MAX_DAYS if words else FIXTURES_BROWSE_MAX_DAYS, hours=1))
 
-    # This query returns the fixtures without checking for odds and results availability
-    # return conn.query(f"SELECT DISTINCT(f.event_id), f.league_id, f.league_name, f.starts, f.runner_home, f.runner_away FROM {TABLE_FIXTURES} f, {TABLE_ODDS} o, {TABLE_RESULTS} r WHERE f.sport_id = {sport_id} AND DATE(f.starts) >= '{date_from.strftime('%Y-%m-%d')}' AND DATE(f.starts) <= '{date_to.strftime('%Y-%m-%d')}' AND o.event_id = f.event_id AND r.event_id = f.event_id ORDER BY f.starts")
+    return read_replica(QUERY_SEARCH_FIXTURES, timeout=DB_STATEMENT_TIMEOUTS['search_fixtures'], sport_id=sport_id, starts_from=starts_from, starts_to=starts_to, contains=contains, prefix=prefix, limit=limit)
 
 
-@st.cache_data()
+@guarded_read()
 def get_odds(event_id: int):
     """
     Fetches odds information from the database for a specific event.
 
     This function retrieves period, market, line, and related odds data
     from the specified table within the database using the given event ID.
-    It uses caching to improve performance by storing query results.
+    It is served from the per-event odds cache shared with get_odds_many.
 
     :param event_id: The identifier of the event for which odds information
         is to be fetched.
     :type event_id: int
     :return: A query result containing columns - period, market, line, odds1,
         odds0, and odds2 for the specified event.
-    :rtype: Any
+    :rtype: pd.DataFrame
     """
-    return conn.query(f"SELECT period, market, line, odds1, odds0, odds2 FROM {TABLE_ODDS} WHERE event_id = {event_id}")
+    return get_odds_many(event_ids=[event_id])[event_id]
 
 
-@st.cache_data()
-def get_bets(username: str, sports: str, bookmakers: str, tags: str, bet_status: str, date_from: datetime, date_to: datetime):
+def get_odds_many(event_ids: list):
     """
-    Fetches a filtered list of bets from the database based on specified parameters.
+    Fetches the odds of a set of events. Events not cached yet (or expired after ODDS_CACHE_TTL + ODDS_STALE_TTL seconds)
+    are fetched together with one query, split per event and cached per event.
 
-    This function queries the database for bets associated with a given username that
-    meet specified filtering criteria such as sports, bookmakers, tags, bet status,
-    and a date range. The results are returned as a list of dictionaries containing
-    various bet details.
+    :param event_ids: The IDs of the events.
+    :type event_ids: list[int]
+    :return: A dictionary mapping every event ID to a dataframe with the columns period, market, line, odds1, odds0 and odds2.
+    :rtype: dict[int, pd.DataFrame]
+    """
+    return load_odds(odds_cache=get_odds_cache(), event_ids=event_ids)
 
-    :param username: The username of the user whose bets are being queried.
+
+@st.cache_resource()
+def get_odds_cache():
+    """
+    Holds the odds per event for all sessions of this process: a lock, the cached odds (event_id -> (fetched at, odds))
+    and the in-flight fetches (event_id -> future).
+
+    :return: The odds cache.
+    :rtype: dict
+    """
+    return dict(lock=threading.Lock(), events=dict(), inflight=dict())
+
+
+def fetch_odds(odds_cache: dict, futures: dict):
+    """
+    Fetches the odds of the claimed events with one query, caches them per event and resolves their futures.
+
+    :param odds_cache: The odds cache as returned by get_odds_cache.
+    :type odds_cache: dict
+    :param futures: The futures of the events claimed by the caller (event_id -> future).
+    :type futures: dict[int, Future]
+    :return: None
+    """
+    try:
+        odds = get_odds_by_event_ids(event_ids=list(futures))
+    except Exception as ex:
+        # Background refreshes & prefetches have no caller to report to
+        logger.warning('Fetching the odds of %d event(s) failed: %s', len(futures), ex)
+        with odds_cache['lock']:
+            for event_id in futures:
+                odds_cache['inflight'].pop(event_id, None)
+        for future in futures.values():
+            future.set_exception(ex)
+        return
+
+    now = time.time()
+    odds_per_event = {event_id: event_odds.drop(columns='event_id').reset_index(drop=True) for event_id, event_odds in odds.groupby('event_id')}
+    empty = odds.drop(columns='event_id').iloc[0:0]
+
+    with odds_cache['lock']:
+        for event_id in futures:
+            odds_cache['events'][event_id] = (now, odds_per_event.get(event_id, empty))
+            odds_cache['inflight'].pop(event_id, None)
+
+        # Drop events past their stale period, so the cache doesn't grow without bounds
+        expired = [event_id for event_id, (fetched_at, event_odds) in odds_cache['events'].items() if now - fetched_at > ODDS_CACHE_TTL + ODDS_STALE_TTL]
+        for event_id in expired:
+            odds_cache['events'].pop(event_id, None)
+
+    for event_id, future in futures.items():
+        future.set_result(odds_per_event.get(event_id, empty))
+
+
+def load_odds(odds_cache: dict, event_ids: list):
+    """
+    Implementation of get_odds_many on an explicitly passed odds cache, so it can run in a background thread
+    (outside of a Streamlit script run).
+
+    Concurrent sessions asking for the same event share one in-flight fetch. Odds expired less than ODDS_STALE_TTL
+    seconds ago are returned right away and refreshed by one background fetch.
+
+    :param odds_cache: The odds cache as returned by get_odds_cache.
+    :type odds_cache: dict
+    :param event_ids: The IDs of the events.
+    :type event_ids: list[int]
+    :return: A dictionary mapping every event ID to its odds.
+    :rtype: dict[int, pd.DataFrame]
+    """
+    now, result, waiting, claimed, refresh = time.time(), dict(), dict(), dict(), dict()
+
+    with odds_cache['lock']:
+        for event_id in dict.fromkeys(int(event_id) for event_id in event_ids):
+            entry, future = odds_cache['events'].get(event_id), odds_cache['inflight'].get(event_id)
+
+            if entry is not None and now - entry[0] <= ODDS_CACHE_TTL:
+                result[event_id] = entry[1]
+            elif entry is not None and now - entry[0] <= ODDS_CACHE_TTL + ODDS_STALE_TTL:
+                result[event_id] = entry[1]
+                if future is None:
+                    refresh[event_id] = odds_cache['inflight'][event_id] = Future()
+            elif future is not None:
+                waiting[event_id] = future
+            else:
+                claimed[event_id] = odds_cache['inflight'][event_id] = Future()
+
+    if refresh:
+        get_refresh_executor().submit(fetch_odds, odds_cache, refresh)
+    if claimed:
+        fetch_odds(odds_cache, claimed)
+
+    result.update({event_id: future.result() for event_id, future in {**claimed, **waiting}.items()})
+
+    return {int(event_id): result[int(event_id)] for event_id in event_ids}
+
+
+@st.cache_resource()
+def get_prefetch_executor():
+    """
+    :return: The background thread pool used to prefetch odds (one per process).
+    :rtype: ThreadPoolExecutor
+    """
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix='prefetch_odds')
+
+
+def prefetch_odds(event_ids: list, count: int = ODDS_PREFETCH_COUNT):
+    """
+    Fetches the odds of the first count events in a background thread, so the market, period, side and line
+    dropdowns are served from the cache once the user picks one of these events. Returns immediately.
+
+    :param event_ids: The IDs of the listed events, in display order.
+    :type event_ids: list[int]
+    :param count: The maximum number of events to prefetch (0 disables the prefetch).
+    :type count: int
+    :return: None
+    """
+    odds_cache, now = get_odds_cache(), time.time()
+    with odds_cache['lock']:
+        events, inflight = odds_cache['events'], odds_cache['inflight']
+        missing = [int(event_id) for event_id in event_ids[:count] if int(event_id) not in inflight and (int(event_id) not in events or now - events[int(event_id)][0] > ODDS_CACHE_TTL)]
+
+    if missing:
+        get_prefetch_executor().submit(load_odds, odds_cache, missing)
+
+
+@st.cache_resource()
+def get_bets_versions():
+    """
+    Holds the bets version stamp of every user in this process (username -> stamp).
+
+    The stamp is folded into the cache keys of the bet queries (get_bets_page, get_user_facets, ...). Any write to
+    a user's bets bumps the stamp, which invalidates the cached bet queries of this user only, while
+    shared reference data (fixtures, odds) stays cached.
+
+    :return: A dictionary mapping usernames to version stamps.
+    :rtype: dict[str, int]
+    """
+    return dict()
+
+
+def get_bets_version(username: str):
+    """
+    :param username: The username of the user.
     :type username: str
-    :param sports: A comma-separated string of sports to filter bets.
-    :type sports: str
-    :param bookmakers: A comma-separated string of bookmakers to filter bets.
-    :type bookmakers: str
-    :param tags: A comma-separated string of tags to filter bets.
-    :type tags: str
-    :param bet_status: A comma-separated string of bet statuses to filter bets.
-    :type bet_status: str
-    :param date_from: The start date of the date range for filtering bets.
-    :type date_from: datetime
-    :param date_to: The end date of the date range for filtering bets.
-    :type date_to: datetime
-    :return: A list of dictionaries where each dictionary represents a bet record.
-    :rtype: list
-    """
-    return conn.query(f"SELECT delete_bet, id, tag, starts, sport_name, league_name, runner_home, runner_away, market, period_name, side_name, line, odds, stake, bookmaker, bet_status, score_home, score_away, profit, cls_odds, true_cls, cls_limit, ev, clv, bet_added FROM {TABLE_BETS} WHERE user = '{username}' AND sport_name IN {sports} AND bookmaker IN {bookmakers} AND tag in {tags} AND bet_status in {bet_status} AND DATE(starts) >= '{date_from.strftime('%Y-%m-%d')}' AND DATE(starts) <= '{date_to.strftime('%Y-%m-%d')}' ORDER BY starts").to_dict('records')
-
-
-@st.cache_data()
-def get_user_unique_sports(username: str):
-    """
-    Fetches a list of unique sports associated with a given user's betting data.
-    This function interacts with a database to retrieve distinct sports where the
-    user has placed bets. The results are cached to improve performance and reduce
-    unnecessary database queries.
-
-    .. note::
-        Ensure the connection to the database is valid and the table referenced
-        by `TABLE_BETS` exists and contains the required schema.
-
-    :param username: The username of the user for whom the unique sports are retrieved.
+    :return: The current bets version stamp of the user.
+    :rtype: int
+    """
+    return get_bets_versions().setdefault(username, time.time_ns())
+
+
+def bump_bets_version(username: str):
+    """
+    Invalidates the cached bet queries of a user, i.e. after the user's bets were added, edited or deleted.
+
+    :param username: The username of the user.
     :type username: str
-    :return: A list of unique sports associated with the user's bets.
-    :rtype: list[str]
+    :return: None
     """
-    return conn.query(f"SELECT DISTINCT(sport_name) FROM {TABLE_BETS} WHERE user = '{username}'")['sport_name'].tolist()
+    get_bets_versions()[username] = time.time_ns()
 
 
-@st.cache_data()
-def get_user_unique_leagues(username: str, sports: str):
+def typed_bets(bets: pd.DataFrame):
     """
-    Fetches a distinct list of league names based on the specified user and sports.
-    This function uses caching to improve performance for repetitive queries.
+    Applies the explicit bets schema (BETS_DTYPES) to a dataframe of bets. Text columns with few distinct
+    values become categoricals, odds & clv columns float32 and starts & bet_added datetime64. This cuts the
+    memory of large histories several-fold compared to generic object/float64 columns.
+
+    :param bets: A dataframe of bets as selected by QUERY_BETS_PAGE.
+    :type bets: pd.DataFrame
+    :return: The typed dataframe.
+    :rtype: pd.DataFrame
+    """
+    return bets.astype({column: dtype for column, dtype in BETS_DTYPES.items() if column in bets.columns})
+
 
-    :param username: The username of the user whose league data needs to be fetched.
+@guarded_read()
+def get_bets_page(username: str, sports: tuple, bookmakers: tuple, tags: tuple, bet_status: tuple, starts_from: datetime, starts_to: datetime, after_starts: datetime = None, after_id: int = 0, limit: int = BETS_PAGE_SIZE):
+    """
+    Fetches one page of the filtered bets, ordered by starts and id (keyset paging).
+
+    Pass the starts and id of the last bet of the previous page to get the next page. Every page is one
+    index range scan, no matter how deep into the history the page is. Pages are cached per bets version
+    of the user (see get_bets_page_cached).
+
+    :param username: The username of the user whose bets are being queried.
     :type username: str
-    :param sports: A string representing the sports categories to filter leagues.
-    :type sports: str
-    :return: A list containing unique league names associated with the user and sports.
-    :rtype: list
+    :param sports: The sports filter encoded by tools.encode_filter: None (no filter), ('IN', sports) or ('NOT IN', excluded sports).
+    :type sports: tuple | None
+    :param bookmakers: The bookmakers filter encoded by tools.encode_filter: None (no filter), ('IN', bookmakers) or ('NOT IN', excluded bookmakers).
+    :type bookmakers: tuple | None
+    :param tags: The tags filter encoded by tools.encode_filter: None (no filter), ('IN', tags) or ('NOT IN', excluded tags).
+    :type tags: tuple | None
+    :param bet_status: The bet statuses filter encoded by tools.encode_filter: None (no filter), ('IN', bet statuses) or ('NOT IN', excluded bet statuses).
+    :type bet_status: tuple | None
+    :param starts_from: The start of the half-open range of event starts (storage time, see tools.get_storage_range).
+    :type starts_from: datetime
+    :param starts_to: The end of the half-open range of event starts (storage time, excluded).
+    :type starts_to: datetime
+    :param after_starts: The starts of the last bet of the previous page, None for the first page.
+    :type after_starts: datetime
+    :param after_id: The id of the last bet of the previous page.
+    :type after_id: int
+    :param limit: The page size.
+    :type limit: int
+    :return: A dataframe with one row per bet, typed as described in typed_bets.
+    :rtype: pd.DataFrame
     """
-    return conn.query(f"SELECT DISTINCT(league_name) FROM {TABLE_BETS} WHERE user = '{username}' AND sport_name IN {sports}")['league_name'].tolist()
+    return get_bets_page_cached(username, get_bets_version(username), sports, bookmakers, tags, bet_status, starts_from, starts_to, after_starts or datetime(1970, 1, 1), after_id, limit)
 
 
-@st.cache_data()
-def get_user_unique_bookmakers(username: str, sports: str):
+@st.cache_data(max_entries=1000, show_spinner=False)
+def get_bets_page_cached(username: str, bets_version: int, sports: tuple, bookmakers: tuple, tags: tuple, bet_status: tuple, starts_from: datetime, starts_to: datetime, after_starts: datetime, after_id: int, limit: int):
     """
-    Retrieve a list of unique bookmakers associated with a specific user and sports.
+    Cached query of get_bets_page. The bets version of the user is part of the cache key, so bumping
+    the version (see bump_bets_version) invalidates the cached bets of this user only.
+    """
+    return typed_bets(read_filtered_bets('page', bets_version, sports, bookmakers, tags, bet_status, timeout=DB_STATEMENT_TIMEOUTS['get_bets_page'], username=username, starts_from=starts_from, starts_to=starts_to, after_starts=after_starts, after_id=after_id, limit=limit))
+
+
+@guarded_read()
+def get_bets_performance(username: str, sports: tuple, bookmakers: tuple, tags: tuple, bet_status: tuple, starts_from: datetime, starts_to: datetime):
+    """
+    Fetches profit and ev of all graded (bet_status != 'na') filtered bets, ordered like the bets table,
+    for the performance graph. This covers the full filtered set even if the bets table only shows the
+    first pages. Results are cached per bets version of the user.
+
+    :param username: The username of the user whose bets are being queried.
+    :type username: str
+    :param sports: The sports filter encoded by tools.encode_filter: None (no filter), ('IN', sports) or ('NOT IN', excluded sports).
+    :type sports: tuple | None
+    :param bookmakers: The bookmakers filter encoded by tools.encode_filter: None (no filter), ('IN', bookmakers) or ('NOT IN', excluded bookmakers).
+    :type bookmakers: tuple | None
+    :param tags: The tags filter encoded by tools.encode_filter: None (no filter), ('IN', tags) or ('NOT IN', excluded tags).
+    :type tags: tuple | None
+    :param bet_status: The bet statuses filter encoded by tools.encode_filter: None (no filter), ('IN', bet statuses) or ('NOT IN', excluded bet statuses).
+    :type bet_status: tuple | None
+    :param starts_from: The start of the half-open range of event starts (storage time, see tools.get_storage_range).
+    :type starts_from: datetime
+    :param starts_to: The end of the half-open range of event starts (storage time, excluded).
+    :type starts_to: datetime
+    :return: A dataframe with the columns profit and ev.
+    :rtype: pd.DataFrame
+    """
+    return get_bets_performance_cached(username, get_bets_version(username), sports, bookmakers, tags, bet_status, starts_from, starts_to)
+
 
-    This function interacts with a database to fetch distinct bookmaker names
-    that are linked to bets placed by the user for the given sports.
+@st.cache_data(max_entries=1000, show_spinner=False)
+def get_bets_performance_cached(username: str, bets_version: int, sports: tuple, bookmakers: tuple, tags: tuple, bet_status: tuple, starts_from: datetime, starts_to: datetime):
+    """
+    Cached query of get_bets_performance, keyed by the bets version of the user (see get_bets_page_cached).
+    """
+    return read_filtered_bets('performance', bets_version, sports, bookmakers, tags, bet_status, timeout=DB_STATEMENT_TIMEOUTS['get_bets_performance'], username=username, starts_from=starts_from, starts_to=starts_to)
+
+
+@guarded_read()
+def get_bet_summary(username: str, sports: tuple, bookmakers: tuple, tags: tuple, bet_status: tuple, starts_from: datetime, starts_to: datetime):
+    """
+    Aggregates the headline stats of all filtered bets in the database, so the header doesn't need the bets themselves.
+    Results are cached per bets version of the user.
 
-    :param username: The username of the user for whom the bookmakers are being queried.
+    :param username: The username of the user whose bets are being queried.
     :type username: str
-    :param sports: A comma-separated string of sports names for which the query is performed.
-    :type sports: str
-    :return: A list of unique bookmaker names for the specified user and sports.
-    :rtype: list
+    :param sports: The sports filter encoded by tools.encode_filter: None (no filter), ('IN', sports) or ('NOT IN', excluded sports).
+    :type sports: tuple | None
+    :param bookmakers: The bookmakers filter encoded by tools.encode_filter: None (no filter), ('IN', bookmakers) or ('NOT IN', excluded bookmakers).
+    :type bookmakers: tuple | None
+    :param tags: The tags filter encoded by tools.encode_filter: None (no filter), ('IN', tags) or ('NOT IN', excluded tags).
+    :type tags: tuple | None
+    :param bet_status: The bet statuses filter encoded by tools.encode_filter: None (no filter), ('IN', bet statuses) or ('NOT IN', excluded bet statuses).
+    :type bet_status: tuple | None
+    :param starts_from: The start of the half-open range of event starts (storage time, see tools.get_storage_range).
+    :type starts_from: datetime
+    :param starts_to: The end of the half-open range of event starts (storage time, excluded).
+    :type starts_to: datetime
+    :return: A dictionary with the keys bets (number of graded bets), turnover (stake of graded bets), sum_stake,
+        sum_odds_stake (sum of odds * stake), sum_profit and sum_ev.
+    :rtype: dict
+    """
+    return get_bet_summary_cached(username, get_bets_version(username), sports, bookmakers, tags, bet_status, starts_from, starts_to)
+
+
+@st.cache_data(max_entries=1000, show_spinner=False)
+def get_bet_summary_cached(username: str, bets_version: int, sports: tuple, bookmakers: tuple, tags: tuple, bet_status: tuple, starts_from: datetime, starts_to: datetime):
     """
-    return conn.query(f"SELECT DISTINCT(bookmaker) FROM {TABLE_BETS} WHERE user = '{username}' AND sport_name IN {sports}")['bookmaker'].tolist()
+    Cached query of get_bet_summary, keyed by the bets version of the user (see get_bets_page_cached).
+    """
+    summary = read_filtered_bets('summary', bets_version, sports, bookmakers, tags, bet_status, timeout=DB_STATEMENT_TIMEOUTS['get_bet_summary'], username=username, starts_from=starts_from, starts_to=starts_to).iloc[0]
+    return {key: float(value) for key, value in summary.items()}
 
 
-@st.cache_data()
-def get_user_unique_tags(username: str, sports: str, bookmakers: str):
+@guarded_read(fallback=False)
+def get_bets_changed_since(username: str, since: datetime, overlap: int = BETS_CHANGES_OVERLAP):
     """
-    Fetches a list of unique tags associated with a specific user based on their bets. The tags are filtered
-    by the username, selected sports, and bookmakers provided as parameters. Results are cached for efficiency.
+    Fetches the bets of a user inserted, updated (by the user or by the grader) or deleted since a sync point.
+    This is a cheap delta poll on (user, updated_at), so a session can merge the changes into the bets it
+    already holds instead of downloading all bets again. Never cached.
+
+    The poll re-reads the last overlap seconds before the sync point, so changes committed while the previous
+    poll ran are not missed. Merging the returned rows is idempotent, rows seen before can simply be merged again.
 
-    :param username: The username of the user whose unique tags need to be retrieved.
+    :param username: The username of the user whose bets are being polled.
     :type username: str
-    :param sports: A string representing the sports to filter bets by. Expected to be a list-like string
-                   representation compatible with the query requirements.
-    :type sports: str
-    :param bookmakers: A string representing the bookmakers to filter bets by. Expected to be a list-like
-                       string representation compatible with the query requirements.
-    :type bookmakers: str
-    :return: A list of unique tags associated with the user's filtered bets.
-    :rtype: list
+    :param since: The sync point returned by the previous poll or by get_bets_sync_point.
+    :type since: datetime
+    :param overlap: The number of seconds re-read before the sync point.
+    :type overlap: int
+    :return: A tuple of the changed bets (typed dataframe with the columns of get_bets_page plus updated_at, deleted bets
+        have delete_bet True) and the sync point for the next poll.
+    :rtype: tuple[pd.DataFrame, datetime]
     """
-    return conn.query(f"SELECT DISTINCT(tag) FROM {TABLE_BETS} WHERE user = '{username}' AND sport_name IN {sports} AND bookmaker IN {bookmakers}")['tag'].tolist()
+    changes = typed_bets(read(QUERY_BETS_CHANGED_SINCE, timeout=DB_STATEMENT_TIMEOUTS['get_bets_changed_since'], username=username, since=since - timedelta(seconds=overlap)))
+    return changes, max(since, changes['updated_at'].max().to_pydatetime()) if not changes.empty else since
 
 
-@st.cache_data()
-def get_user_unique_bet_status(username: str, sports: str, bookmakers: str, tags: str):
+@guarded_read()
+def get_bets_sync_point(username: str):
     """
-    Retrieves the unique bet statuses for a user based on specific criteria including sports,
-    bookmakers, and tags. The function performs a query to get distinct bet statuses
-    from the bets table filtered by the provided user and other criteria. The result is
-    then returned as a list of distinct bet statuses.
+    Returns the sync point of a user's bets, i.e. the time of the latest change. Take it before loading the
+    bets, then get_bets_changed_since returns everything changed after the load.
 
-    :param username: The username of the user for whom bet statuses are to be retrieved.
+    :param username: The username of the user.
     :type username: str
-    :param sports: Comma-separated sports names to filter bets.
-    :type sports: str
-    :param bookmakers: Comma-separated bookmakers to filter bets.
-    :type bookmakers: str
-    :param tags: Comma-separated tags to filter bets.
-    :type tags: str
-    :return: A list of unique bet statuses for the user filtered by the specified criteria.
-    :rtype: list
+    :return: The time of the latest change of the user's bets (1970-01-01 if the user has no bets).
+    :rtype: datetime
     """
-    return conn.query(f"SELECT DISTINCT(bet_status) FROM {TABLE_BETS} WHERE user = '{username}' AND sport_name IN {sports} AND bookmaker IN {bookmakers} AND tag IN {tags}")['bet_status'].tolist()
+    updated_at = read(QUERY_BETS_SYNC_POINT, timeout=DB_STATEMENT_TIMEOUTS['get_bets_sync_point'], username=username)['updated_at'].iloc[0]
+    return datetime(1970, 1, 1) if pd.isna(updated_at) else pd.Timestamp(updated_at).to_pydatetime()
 
 
-@st.cache_data()
-def get_user_unique_starts(username: str, sports: str, bookmakers: str, tags: str, bet_status: str):
+@guarded_read()
+def get_user_facets(username: str):
     """
-    Fetches unique start dates for bets placed by a specific user based on the given filters.
+    Fetches the filter facets of a user's bets in a single query.
 
-    This function queries the database to retrieve distinct starting dates for bets that match
-    the provided filters including sports, bookmakers, tags, and bet status. It leverages
-    caching to optimize performance for repeated queries with the same parameters.
+    Every row of the result is one distinct combination of sport, bookmaker, tag and bet status
+    together with the number of bets and the earliest/latest event start of that combination.
+    The cascading sidebar filters (sports -> bookmakers -> tags -> status -> date range) are
+    computed from this result in memory, so changing a filter doesn't hit the database.
+    Results are cached per bets version of the user.
 
-    :param username: The username of the user whose bet starts are to be retrieved
-    :param sports: A string containing the filtered sports names
-    :param bookmakers: A string indicating the filtered bookmaker names
-    :param tags: A string of tags to filter bets
-    :param bet_status: A string indicating the status of bets to include in the query
-    :return: A list of distinct start dates for bets matching the filters
+    :param username: The username of the user whose facets are to be retrieved.
+    :type username: str
+    :return: A dataframe with the columns sport_name, bookmaker, tag, bet_status, bets, starts_min and starts_max.
+    :rtype: pd.DataFrame
     """
-    return conn.query(f"SELECT DISTINCT(starts) FROM {TABLE_BETS} WHERE user = '{username}' AND sport_name IN {sports} AND bookmaker IN {bookmakers} AND tag IN {tags} AND bet_status IN {bet_status}")['starts'].tolist()
+    return get_user_facets_cached(username, get_bets_version(username))
+
+
+@st.cache_data(max_entries=1000, show_spinner=False)
+def get_user_facets_cached(username: str, bets_version: int):
+    """
+    Cached query of get_user_facets, keyed by the bets version of the user (see get_bets_page_cached).
+    """
+    return read_bets(QUERY_USER_FACETS, bets_version, timeout=DB_STATEMENT_TIMEOUTS['get_user_facets'], username=username)
 
 
 def append_bet(data: dict):
@@ -256,331 +1200,479 @@ def append_bet(data: dict):
         - "ev": Expected value of the bet
         - "clv": Closing line value
         - "bet_added": Timestamp for when the bet was added
+        - "idempotency_key": Client-generated unique key of the bet (uuid4), a bet with a known key is not inserted again
 
     :return: None
     """
-    query = f"INSERT INTO {TABLE_BETS} (user, tag, starts, sport_id, sport_name, league_id, league_name, event_id, runner_home, runner_away, market, period, period_name, side, side_name, raw_line, line, odds, stake, bookmaker, bet_status, score_home, score_away, profit, cls_odds, true_cls, cls_limit, ev, clv, bet_added) VALUES(:user, :tag, :starts, :sport_id, :sport_name, :league_id, :league_name, :event_id, :runner_home, :runner_away, :market, :period, :period_name, :side, :side_name, :raw_line, :line, :odds, :stake, :bookmaker, :bet_status, :score_home, :score_away, :profit, :cls_odds, :true_cls, :cls_limit, :ev, :clv, :bet_added)"
-
     with conn.session as session:
-        session.execute(text(query), params=dict(user=data['user'], tag=data['tag'], starts=data['starts'], sport_id=data['sport_id'], sport_name=data['sport_name'], league_id=data['league_id'], league_name=data['league_name'], event_id=data['event_id'], runner_home=data['runner_home'], runner_away=data['runner_away'], market=data['market'], period=data['period'], period_name=data['period_name'], side=data['side'], side_name=data['side_name'], raw_line=data['raw_line'], line=data['line'], odds=data['odds'], stake=data['stake'], bookmaker=data['bookmaker'], bet_status=data['bet_status'], score_home=data['score_home'], score_away=data['score_away'], profit=data['profit'], cls_odds=data['cls_odds'], true_cls=data['true_cls'], cls_limit=data['cls_limit'], ev=data['ev'], clv=data['clv'], bet_added=data['bet_added']))
+        session.execute(QUERY_INSERT_BET_IDEMPOTENT, params={column: data[column] for column in BET_COLUMNS})
         session.commit()
 
+    bump_bets_version(username=data['user'])
 
-def delete_bet(key: int):
-    """
-    Deletes a bet record from the database identified by its key.
 
-    This function constructs and executes an SQL DELETE statement to remove the
-    record associated with the provided key from the bets table. The deletion is
-    made within a session, and the changes are committed to the database.
+def queue_bet(data: dict, timeout: float = BETS_WRITE_QUEUE_TIMEOUT):
+    """
+    Queues a new bet for the bet writer (see get_bet_writer) and returns right away, so a slow database doesn't
+    stall the session. If the queue stays full for timeout seconds, the bet is inserted synchronously instead.
 
-    :param key: The unique identifier of the bet record to be deleted.
-    :type key: int
+    :param data: A dictionary with the same keys as the data parameter of append_bet, including the idempotency_key.
+    :type data: dict
+    :param timeout: The number of seconds to wait for a free slot in the queue.
+    :type timeout: float
     :return: None
     """
-    query = f"DELETE FROM {TABLE_BETS} WHERE id = {key}"
+    try:
+        get_bet_writer().put(data, timeout=timeout)
+    except queue.Full:
+        append_bet(data=data)
 
-    with conn.session as session:
-        session.execute(text(query))
-        session.commit()
 
-
-def set_user_odds_display(username: str, placeholder: st.delta_generator.DeltaGenerator):
+@st.cache_resource()
+def get_bet_writer():
     """
-    Updates the odds display format for a user and reflects changes persistently in the database.
-
-    This function modifies the current odds display format session state based on the input
-    parameters. An SQL query is executed to update the corresponding user's odds display format
-    in the database, ensuring that the changes are saved. A confirmation message is
-    displayed in a Streamlit placeholder, which is then cleared after a short delay.
-
-    :param username: The username of the user whose odds display format is being updated.
-    :param placeholder: A Streamlit DeltaGenerator object used to display messages to the user.
-    :return: None
+    Holds the bounded queue of bets to be inserted (at most BETS_WRITE_QUEUE_SIZE) and starts the background
+    thread inserting them. The thread takes all queued bets (up to BETS_WRITE_BATCH_SIZE) and inserts them with
+    one executemany, then bumps the bets version of their users. If the database rejects the batch (i.e. a
+    DataError or IntegrityError of one bet), the bets are inserted one by one and rejected bets are logged and
+    dropped, so one bad bet doesn't block the queue. Cached as a resource, so only one writer runs per process.
+
+    :return: The queue of bets to be inserted.
+    :rtype: queue.Queue
     """
-    st.session_state.odds_display = st.session_state.odds_display_key
+    bets_queue, bets_versions = queue.Queue(maxsize=BETS_WRITE_QUEUE_SIZE), get_bets_versions()
 
-    query = f"UPDATE {TABLE_USERS} SET odds_display = '{st.session_state.odds_display}' WHERE username = '{username}'"
+    def insert_queued():
+        while True:
+            batch = [bets_queue.get()]
+            while len(batch) < BETS_WRITE_BATCH_SIZE and not bets_queue.empty():
+                batch.append(bets_queue.get_nowait())
 
-    with conn.session as session:
-        session.execute(text(query))
-        session.commit()
+            try:
+                insert_bets_retrying(batch)
+            except Exception:
+                for data in batch:
+                    try:
+                        insert_bets_retrying([data])
+                    except Exception as ex:
+                        logger.error('Dropped queued bet %s of %s, the database rejected it: %s. Bet: %s', data.get('idempotency_key'), data.get('user'), ex, data)
 
-    placeholder.success('Odds format changed successfully!')
-    time.sleep(2)
-    placeholder.empty()
+            # Same as bump_bets_version, on the dictionary passed in as this thread runs outside of a Streamlit script run
+            for username in {data['user'] for data in batch}:
+                bets_versions[username] = time.time_ns()
 
+    worker = threading.Thread(target=insert_queued, name='insert_queued_bets', daemon=True)
+    worker.start()
+    return bets_queue
 
-def set_user_timezone(username: str, placeholder: st.delta_generator.DeltaGenerator):
-    """
-    Sets the user's timezone in the application's database and provides user feedback.
 
-    This function updates the timezone for the specified username in the database
-    and uses a `placeholder` to notify the user of a successful operation. It retrieves
-    the timezone value from the application's session state and commits the change
-    to a database. After successfully updating, it provides a success message through
-    a `placeholder` object and automatically clears out the placeholder after a brief delay.
+def insert_bets_retrying(bets: list):
+    """
+    Inserts bets with one executemany of the idempotent insert. Transient failures (connection errors, pool timeouts)
+    are retried with exponential backoff (BETS_WRITE_RETRY_DELAY up to BETS_WRITE_RETRY_MAX_DELAY seconds) until the
+    insert succeeds, the idempotency keys make the retry safe. All other errors are raised.
 
-    :param username: The username of the user whose timezone will be updated.
-    :type username: str
-    :param placeholder: An element used to temporarily display success notifications to the user.
-    :type placeholder: st.delta_generator.DeltaGenerator
+    :param bets: A list of dictionaries with the same keys as the data parameter of append_bet, including the idempotency_key.
+    :type bets: list[dict]
     :return: None
     """
-    st.session_state.timezone = st.session_state.timezone_key
+    for attempt in itertools.count():
+        try:
+            with connect() as connection:
+                connection.execute(QUERY_INSERT_BET_IDEMPOTENT, [{column: data[column] for column in BET_COLUMNS} for data in bets])
+                connection.commit()
+            return
+        except (exc.OperationalError, exc.TimeoutError) as ex:
+            delay = min(BETS_WRITE_RETRY_DELAY * 2 ** attempt, BETS_WRITE_RETRY_MAX_DELAY)
+            logger.warning('Inserting %d queued bet(s) failed, retrying in %s seconds: %s', len(bets), delay, ex)
+            time.sleep(delay)
+
+
+def append_bets(bets: list, chunk_size: int = BETS_IMPORT_CHUNK_SIZE, progress=None):
+    """
+    Bulk inserts bet records. The bets are inserted in chunks with one executemany and one
+    transaction per chunk, so a failing chunk doesn't roll back the chunks already imported.
+    Bets with an idempotency key inserted before (i.e. the same file imported again) are skipped.
+
+    :param bets: A list of dictionaries with the same keys as the data parameter of append_bet.
+    :type bets: list[dict]
+    :param chunk_size: The number of bets inserted per transaction.
+    :type chunk_size: int
+    :param progress: Optional callback called with (number of inserted bets, total number of bets) after each chunk.
+    :type progress: Callable[[int, int], None] | None
+    :return: The number of processed bets (inserted or skipped).
+    :rtype: int
+    """
+    inserted = 0
+    for start in range(0, len(bets), chunk_size):
+        chunk = [{column: data[column] for column in BET_COLUMNS} for data in bets[start:start + chunk_size]]
 
-    query = f"UPDATE {TABLE_USERS} SET timezone = '{st.session_state.timezone}' WHERE username = '{username}'"
+        with conn.session as session:
+            session.execute(QUERY_INSERT_BET_IDEMPOTENT, chunk)
+            session.commit()
 
-    with conn.session as session:
-        session.execute(text(query))
-        session.commit()
+        for username in {data['user'] for data in chunk}:
+            bump_bets_version(username=username)
+
+        inserted += len(chunk)
+        if progress is not None:
+            progress(inserted, len(bets))
 
-    placeholder.success('Timezone changed successfully!')
-    time.sleep(2)
-    placeholder.empty()
+    return inserted
 
 
-def set_user_default_sport(username: str, placeholder: st.delta_generator.DeltaGenerator):
+def get_fixtures_by_event_ids(event_ids: list, chunk_size: int = BETS_IMPORT_CHUNK_SIZE):
     """
-    Sets the default sport for a user in the session state and updates the database
-    accordingly. After updating, a success message is displayed temporarily.
+    Fetches the fixtures of a set of events, i.e. to validate and enrich imported bets.
+
+    :param event_ids: The IDs of the events.
+    :type event_ids: list[int]
+    :param chunk_size: The maximum number of event IDs per query.
+    :type chunk_size: int
+    :return: A dataframe with the columns event_id, sport_id, league_id, league_name, starts, runner_home and runner_away.
+    :rtype: pd.DataFrame
+    """
+    return read_chunked(QUERY_FIXTURES_BY_EVENT_IDS, 'event_ids', [int(event_id) for event_id in event_ids], chunk_size, DB_STATEMENT_TIMEOUTS['get_fixtures_by_event_ids'])
 
-    :param username: The username of the user whose default sport needs to be updated.
-    :type username: str
-    :param placeholder: A Streamlit DeltaGenerator object to render messages in the UI.
-    :type placeholder: st.delta_generator.DeltaGenerator
-    :return: None
+
+def get_odds_by_import_keys(keys: list):
     """
-    st.session_state.default_sport = st.session_state.default_sport_key
+    Fetches the odds lines of the markets of imported bets with one query. The keys are written to a temporary
+    table and joined, so only the odds of the imported markets are read instead of all odds of the events.
 
-    query = f"UPDATE {TABLE_USERS} SET default_sport = '{st.session_state.default_sport}' WHERE username = '{username}'"
+    :param keys: The distinct (event_id, market, period) keys of the imported bets.
+    :type keys: list[tuple[int, str, int]]
+    :return: A dataframe with the columns event_id, period, market, line, odds1, odds0 and odds2.
+    :rtype: pd.DataFrame
+    """
+    rows = [dict(event_id=int(event_id), market=market, period=int(period)) for event_id, market, period in keys]
+    return read_replica(QUERY_ODDS_BY_IMPORT_KEYS, dict(import_keys=rows), DB_STATEMENT_TIMEOUTS['get_odds_by_import_keys'])
 
-    with conn.session as session:
-        session.execute(text(query))
-        session.commit()
 
-    placeholder.success('Default sport changed successfully!')
-    time.sleep(2)
-    placeholder.empty()
+def get_odds_by_event_ids(event_ids: list, chunk_size: int = BETS_IMPORT_CHUNK_SIZE):
+    """
+    Fetches the odds of a set of events in one query per chunk of event IDs.
+
+    :param event_ids: The IDs of the events.
+    :type event_ids: list[int]
+    :param chunk_size: The maximum number of event IDs per query.
+    :type chunk_size: int
+    :return: A dataframe with the columns event_id, period, market, line, odds1, odds0 and odds2.
+    :rtype: pd.DataFrame
+    """
+    return read_chunked(QUERY_ODDS_BY_EVENT_IDS, 'event_ids', [int(event_id) for event_id in event_ids], chunk_size, DB_STATEMENT_TIMEOUTS['get_odds_by_event_ids'])
 
 
-def set_user_default_book(username: str, placeholder: st.delta_generator.DeltaGenerator):
+def delete_bets(username: str, ids: list):
     """
-    Set the default bookmaker for a specific user and update the related database record.
+    Marks bets as deleted with one set-based UPDATE of the existing delete_bet column.
 
-    This function assigns a default bookmaker to a user in the session state and updates
-    the corresponding record in the database. It also provides feedback to the user through
-    a placeholder element and temporarily displays a success message before clearing it.
+    Marked bets are skipped by all reads and physically removed later by purge_deleted_bets,
+    which runs in a background thread off the request path.
 
-    :param username: The unique identifier of the user whose default bookmaker is being set.
+    :param username: The username of the user who owns the bets. Bets of other users are never touched.
     :type username: str
-    :param placeholder: A Streamlit delta generator object for displaying temporary messages.
-    :type placeholder: st.delta_generator.DeltaGenerator
+    :param ids: The IDs of the bets to be deleted.
+    :type ids: list[int]
     :return: None
     """
-    st.session_state.default_book = st.session_state.default_book_key
-
-    query = f"UPDATE {TABLE_USERS} SET default_book = '{st.session_state.default_book}' WHERE username = '{username}'"
+    if not ids:
+        return
 
     with conn.session as session:
-        session.execute(text(query))
+        session.execute(QUERY_DELETE_BETS, params=dict(username=username, ids=[int(dbid) for dbid in ids], user_edit=datetime.now()))
         session.commit()
 
-    placeholder.success('Default bookmaker changed successfully!')
-    time.sleep(2)
-    placeholder.empty()
+    bump_bets_version(username=username)
 
 
-def set_user_default_tag(username: str, placeholder: st.delta_generator.DeltaGenerator):
+def purge_deleted_bets(batch_size: int = BETS_PURGE_BATCH_SIZE, retention: int = BETS_DELETED_RETENTION):
+    """
+    Physically removes the bets marked as deleted more than retention seconds ago, in batches of batch_size
+    rows per transaction to keep lock times short. Until then the deletion is visible to delta polls
+    (see get_bets_changed_since).
+
+    :param batch_size: The maximum number of rows removed per transaction.
+    :type batch_size: int
+    :param retention: The number of seconds deleted bets are kept.
+    :type retention: int
+    :return: The number of removed bets.
+    :rtype: int
     """
-    Updates the default tag for a user in the system and provides user feedback.
+    purged = 0
+    while True:
+        with connect() as connection:
+            rowcount = connection.execute(QUERY_PURGE_DELETED_BETS, dict(batch_size=batch_size, retention=retention)).rowcount
+            connection.commit()
+        purged += rowcount
+        if rowcount < batch_size:
+            return purged
+
+
+@st.cache_resource()
+def start_purge_worker():
+    """
+    Starts the background thread purging deleted bets every BETS_PURGE_INTERVAL seconds.
+    Cached as a resource, so only one worker runs per process.
 
-    This function sets the user's default tag in the system by updating the
-    session state and the database. It also provides a visual confirmation of
-    the update using the provided placeholder.
+    :return: The worker thread.
+    :rtype: threading.Thread
+    """
+    def purge_periodically():
+        while True:
+            time.sleep(BETS_PURGE_INTERVAL)
+            try:
+                purge_deleted_bets()
+            except Exception as ex:
+                logger.warning('Purging deleted bets failed: %s', ex)
+
+    worker = threading.Thread(target=purge_periodically, name='purge_deleted_bets', daemon=True)
+    worker.start()
+    return worker
+
+
+def set_user_odds_display(username: str):
+    """
+    Updates the odds display format of a user, persisted write-behind (see save_user_setting).
 
-    :param username: The username of the target user whose default tag will
-        be updated.
+    :param username: The username of the user whose odds display format is being updated.
     :type username: str
-    :param placeholder: A Streamlit DeltaGenerator object used for displaying
-        feedback to the user.
-    :type placeholder: st.delta_generator.DeltaGenerator
     :return: None
     """
-    st.session_state.default_tag = st.session_state.default_tag_key
+    save_user_setting(username=username, column_name='odds_display', value=st.session_state.odds_display_key, message='Odds format changed successfully!')
 
-    query = f"UPDATE {TABLE_USERS} SET default_tag = '{st.session_state.default_tag}' WHERE username = '{username}'"
 
-    with conn.session as session:
-        session.execute(text(query))
-        session.commit()
+def set_user_timezone(username: str):
+    """
+    Updates the timezone of a user, persisted write-behind (see save_user_setting).
 
-    placeholder.success('Default tag changed successfully!')
-    time.sleep(2)
-    placeholder.empty()
+    :param username: The username of the user whose timezone will be updated.
+    :type username: str
+    :return: None
+    """
+    save_user_setting(username=username, column_name='timezone', value=st.session_state.timezone_key, message='Timezone changed successfully!')
 
 
-def get_user_odds_display(username: str):
+def set_user_default_sport(username: str):
     """
-    Retrieves the odds display setting for a specific user from the database.
-
-    The function interacts with the database to fetch the odds display value
-    associated with a given username. It queries the database using the
-    username and returns the odds display setting as a list.
+    Updates the default sport of a user (preselected when adding a bet), persisted write-behind (see save_user_setting).
 
-    :param username: The username of the user whose odds display setting
-        is to be retrieved.
+    :param username: The username of the user whose default sport needs to be updated.
     :type username: str
+    :return: None
+    """
+    save_user_setting(username=username, column_name='default_sport', value=st.session_state.default_sport_key, message='Default sport changed successfully!')
 
-    :return: A list containing the odds display setting for the specified
-        user.
-    :rtype: list
 
-    :raises KeyError: If the queried result from the database does not
-        contain the expected 'odds_display' key.
-    :raises DatabaseError: If there is an issue with the database
-        connection or query execution.
+def set_user_default_book(username: str):
     """
-    return conn.query(f"SELECT odds_display FROM {TABLE_USERS} WHERE username = '{username}'")['odds_display'].tolist()
+    Updates the default bookmaker of a user (preselected when adding a bet), persisted write-behind (see save_user_setting).
 
-
-def get_user_timezone(username: str):
+    :param username: The username of the user whose default bookmaker is being set.
+    :type username: str
+    :return: None
     """
-    Fetches the timezone associated with a specific username from the users table in the database.
+    save_user_setting(username=username, column_name='default_book', value=st.session_state.default_book_key, message='Default bookmaker changed successfully!')
+
 
-    This function queries the `TABLE_USERS` table to retrieve the timezone value linked to
-    the provided username. It uses the database connection `conn` for executing the query,
-    and the resulting timezone is returned as a list.
+def set_user_default_tag(username: str):
+    """
+    Updates the default tag of a user (preselected when adding a bet), persisted write-behind (see save_user_setting).
 
-    :param username: The username whose timezone is to be retrieved.
+    :param username: The username of the target user whose default tag will be updated.
     :type username: str
-    :return: A list containing the timezone(s) associated with the provided username.
-    :rtype: list
+    :return: None
     """
-    return conn.query(f"SELECT timezone FROM {TABLE_USERS} WHERE username = '{username}'")['timezone'].tolist()
+    save_user_setting(username=username, column_name='default_tag', value=st.session_state.default_tag_key, message='Default tag changed successfully!')
 
 
-def get_user_default_sport(username: str):
+def save_user_setting(username: str, column_name: str, value: str, message: str):
     """
-    Fetches the default sport of a given user from the database.
+    Changes one preference of a user. The session state and the cached profile (see get_user_profile) are
+    updated right away, the database write is handed to the settings writer (see get_settings_writer) and
+    confirmed with a toast. Nothing blocks the script thread.
 
-    This function queries the database to retrieve the default sport
-    associated with the provided username. The default sport is stored
-    in the corresponding user record and is returned as part of the
-    query result. The result is expected to be in list format.
-
-    :param username: The username whose default sport is to be retrieved.
+    :param username: The username of the user.
     :type username: str
-    :return: A list containing the user's default sport.
-    :rtype: list
+    :param column_name: The preference, one of the profile columns (odds_display, timezone, default_sport, default_book, default_tag).
+    :type column_name: str
+    :param value: The new value.
+    :type value: str
+    :param message: The confirmation shown to the user.
+    :type message: str
+    :return: None
     """
-    return conn.query(f"SELECT default_sport FROM {TABLE_USERS} WHERE username = '{username}'")['default_sport'].tolist()
+    st.session_state[column_name] = value
 
+    profile = get_user_profile(username)
+    profile[column_name] = value
 
-def get_user_default_book(username: str):
-    """
-    Fetches the default book assigned to a given user from the database.
+    writer = get_settings_writer()
+    with writer['lock']:
+        changes = writer['pending'].get(username, (None, dict()))[1]
+        writer['pending'][username] = (time.time(), dict(changes, **{column_name: value}))
+        writer['lock'].notify()
 
-    This function retrieves the default book associated with the provided
-    username by querying the respective user data table in the database.
+    st.toast(message)
 
-    :param username: The username of the user whose default book is to be retrieved.
-    :type username: str
-    :return: A list containing the default book associated with the specified user.
-    :rtype: list
+
+@st.cache_resource()
+def get_settings_writer():
+    """
+    Holds the pending settings writes of this process (username -> (time of the user's last change, changed columns -> values))
+    and starts the background thread saving them. A user's changes are saved once none of the user's settings changed for
+    SETTINGS_WRITE_DELAY seconds, so rapid changes (i.e. typing a default tag) are coalesced into one UPDATE per changed column,
+    while changes of other users don't delay it. Changes due at the same time are saved together. Only the changed columns
+    are written, so a profile cached before another replica saved a setting can't revert that setting.
+    Cached as a resource, so only one writer runs per process.
+
+    :return: The writer state (condition lock, pending changes with the time of the last change per user).
+    :rtype: dict
+    """
+    writer = dict(lock=threading.Condition(), pending=dict())
+
+    def save_pending():
+        while True:
+            with writer['lock']:
+                while True:
+                    now = time.time()
+                    due = [username for username, (changed_at, changes) in writer['pending'].items() if now >= changed_at + SETTINGS_WRITE_DELAY]
+                    if due:
+                        break
+                    writer['lock'].wait(min(changed_at for changed_at, changes in writer['pending'].values()) + SETTINGS_WRITE_DELAY - now if writer['pending'] else None)
+                pending = {username: writer['pending'].pop(username)[1] for username in due}
+
+            try:
+                save_user_settings(settings=pending)
+            except Exception as ex:
+                logger.warning('Saving the settings of %d user(s) failed, retrying: %s', len(pending), ex)
+                # Retry after the delay, newer changes of a user win
+                with writer['lock']:
+                    for username, changes in pending.items():
+                        changed_at, newer_changes = writer['pending'].get(username, (time.time(), dict()))
+                        writer['pending'][username] = (changed_at, dict(changes, **newer_changes))
+
+    worker = threading.Thread(target=save_pending, name='save_user_settings', daemon=True)
+    worker.start()
+    return writer
+
+
+def save_user_settings(settings: dict):
+    """
+    Writes the changed settings of several users in a single transaction. The changes are grouped by column and
+    each column is written with one executemany of a fixed UPDATE statement (see QUERY_UPDATE_USER_SETTING).
+
+    :param settings: A dictionary mapping usernames to their changed settings (column name -> value, the columns
+        are odds_display, timezone, default_sport, default_book and default_tag).
+    :type settings: dict[str, dict]
+    :return: None
     """
-    return conn.query(f"SELECT default_book FROM {TABLE_USERS} WHERE username = '{username}'")['default_book'].tolist()
+    columns = dict()
+    for username, changes in settings.items():
+        for column_name, value in changes.items():
+            columns.setdefault(column_name, list()).append(dict(username=username, value=value))
+    if not columns:
+        return
+
+    with connect() as connection:
+        for column_name, values in columns.items():
+            connection.execute(QUERY_UPDATE_USER_SETTING[column_name], values)
+        connection.commit()
 
 
-def get_user_default_tag(username: str):
+@guarded_read()
+def get_user_profile(username: str):
     """
-    Retrieve the default tag associated with a specific user from the database.
+    Fetches all preference columns of a user in a single query. The user is created with default
+    preferences if absent (see bootstrap_user), so this is also the login bootstrap call.
 
-    This function queries the database table containing user data and extracts
-    the default tag corresponding to the given username. The result is subsequently
-    converted into a list.
+    The profile is cached per user as a mutable dictionary (st.cache_resource returns the same object
+    on every call). The set_user_* functions update this dictionary in place and save the changed columns
+    write-behind. It is read again at the start of every session (see refresh_user_profile), as another
+    replica may have saved newer settings.
 
-    :param username: The username of the user whose default tag is to be fetched.
+    :param username: The username of the user whose profile is to be retrieved.
     :type username: str
-    :return: A list containing the default tag associated with the given username.
-    :rtype: list
+    :return: A dictionary with the keys odds_display, timezone, default_sport, default_book and default_tag.
+    :rtype: dict
     """
-    return conn.query(f"SELECT default_tag FROM {TABLE_USERS} WHERE username = '{username}'")['default_tag'].tolist()
+    return get_user_profile_cached(username=username)
 
 
-def append_user(data: dict):
+@st.cache_resource()
+def get_user_profile_cached(username: str):
     """
-    Adds a new user entry into the database.
+    Cached profile of get_user_profile, one mutable dictionary per user.
+    """
+    return bootstrap_user(username=username)
 
-    This function inserts a new row into the users table with the provided
-    user data. It uses the provided data dictionary to extract user
-    details such as username, odds display type, timezone, and default
-    preferences for sport, book, and tag. The function ensures that the
-    changes are committed to the database after the query execution.
 
-    :param data: A dictionary containing the user details to be inserted
-        into the database. The dictionary should include the following keys:
-        - username: The username of the user.
-        - odds_display: Display format of odds (e.g., 'Decimal').
-        - timezone: Timezone preference for the user.
-        - default_sport: Default preferred sport (e.g., 'Soccer').
-        - default_book: Default preferred betting book (e.g., 'Pinnacle').
-        - default_tag: Default tag for the user.
+def refresh_user_profile(username: str):
+    """
+    Reads the profile of a user again at session start, i.e. the login bootstrap call (see bootstrap_user).
+    Settings changed in this process but not saved yet are applied on top.
 
-    :return: None
+    :param username: The username of the user logging in.
+    :type username: str
+    :return: A dictionary with the keys odds_display, timezone, default_sport, default_book and default_tag.
+    :rtype: dict
     """
-    query = f"INSERT INTO {TABLE_USERS} (username, odds_display, timezone, default_sport, default_book, default_tag) VALUES(:username, :odds_display, :timezone, :default_sport, :default_book, :default_tag)"
+    get_user_profile_cached.clear(username=username)
+    profile = get_user_profile(username=username)
 
-    with conn.session as session:
-        session.execute(text(query), params=dict(username=data['username'], odds_display='Decimal', timezone='Europe/London', default_sport='Soccer', default_book='Pinnacle', default_tag=''))
-        session.commit()
+    writer = get_settings_writer()
+    with writer['lock']:
+        profile.update(writer['pending'].get(username, (None, dict()))[1])
+    return profile
 
 
-def get_users():
+def bootstrap_user(username: str):
     """
-    Fetches a list of usernames from the database.
+    Creates the user with default preferences if absent and returns the user's profile.
 
-    This function retrieves all usernames stored in the users table in the database.
-    It queries the table and returns a list of usernames.
+    The insert-if-absent and the profile read run on the same connection and transaction, so a login
+    costs the same no matter how many users exist (no scan of the users table). The NOT EXISTS guard doesn't
+    need the unique username index of migration 2, with the index concurrent first logins can't race either.
+    Until the index exists a race may leave a duplicate row, the first row is read then.
 
-    :return: A list of usernames retrieved from the database
-    :rtype: list
+    :param username: The username of the user logging in.
+    :type username: str
+    :return: A dictionary with the keys odds_display, timezone, default_sport, default_book and default_tag.
+    :rtype: dict
     """
-    return conn.query(f"SELECT username FROM {TABLE_USERS}")['username'].tolist()
+    check_cache_only()
+    with conn.session as session:
+        session.execute(QUERY_INSERT_USER_IF_ABSENT, params=dict(username=username, odds_display='Decimal', timezone='Europe/London', default_sport='Soccer', default_book='Pinnacle', default_tag=''))
+        profile = session.execute(QUERY_USER_PROFILE, params=dict(username=username)).mappings().first()
+        session.commit()
 
+    return dict(profile)
 
-def update_bet(dbid: int, column_name: str, column_value: (str, int, float), placeholder: st.delta_generator.DeltaGenerator):
+
+def update_bets(username: str, changes: dict):
     """
-    Update a specific column of a bet record in the database with the provided value.
+    Applies a batch of edited bet values in a single transaction.
 
-    This function modifies a column in the `TABLE_BETS` database table for a given bet ID
-    (`dbid`). Depending on the column being updated, the value is processed accordingly to
-    ensure proper formatting within the SQL query. After executing the update, a success
-    message is displayed via the provided `placeholder`.
+    The changes are grouped by column and each column is written with one executemany of a fixed
+    UPDATE statement. Either all changes of one editor interaction are committed or none of them.
 
-    :param dbid: The ID of the bet record to be updated.
-    :type dbid: int
-    :param column_name: The name of the database column to update. Accepted values include
-        'bet_status', 'tag', 'bookmaker', 'score_home', 'score_away', and others.
-    :type column_name: str
-    :param column_value: The value to update the column with. Can be any of the
-        specified types depending on the column being updated.
-    :type column_value: str | int | float
-    :param placeholder: A Streamlit DeltaGenerator object used for rendering success
-        messages after the update operation.
-    :type placeholder: st.delta_generator.DeltaGenerator
-    :return: None
+    :param username: The username of the user who owns the bets. Bets of other users are never touched.
+    :type username: str
+    :param changes: A dictionary mapping a column name ('tag', 'bookmaker', 'bet_status', 'score_home',
+        'score_away' or 'profit') to a list of (bet ID, new value) tuples.
+    :type changes: dict[str, list[tuple[int, str | int | float]]]
+    :return: The number of updated values.
+    :rtype: int
     """
-    if column_name in ('bet_status', 'tag', 'bookmaker', 'score_home', 'score_away'):
-        query = f"UPDATE {TABLE_BETS} SET {column_name} = '{column_value}', user_edit = '{datetime.now()}' WHERE id = {dbid}"
-
-    else:
-        query = f"UPDATE {TABLE_BETS} SET {column_name} = {column_value}, user_edit = '{datetime.now()}' WHERE id = {dbid}"
+    user_edit, count = datetime.now(), 0
 
     with conn.session as session:
-        session.execute(text(query))
+        for column_name, values in changes.items():
+            if values:
+                session.execute(QUERY_UPDATE_BET[column_name], [dict(id=dbid, value=value, user_edit=user_edit, username=username) for dbid, value in values])
+                count += len(values)
         session.commit()
 
-    placeholder.success(f'{column_name} successfully updated for bet ID {dbid}.')
-    time.sleep(0.25)
-    placeholder.empty()
+    bump_bets_version(username=username)
+
+    return count
@@ -0,0 +1,278 @@
+# The module 'schema.py' holds the versioned schema migrations (columns & indexes the queries of 'db_pinnacle_remote.py' rely on)
+# and a check running EXPLAIN on every statement of 'db_pinnacle_remote.py'
+#
+# Apply pending migrations:  python schema.py migrate  (a deploy step, never run from the app: the ALTER TABLEs of large tables take long)
+# Check the query plans:     python schema.py check  (exit code 1 if a read scans a full table)
+
+import re
+import sys
+from datetime import datetime
+from sqlalchemy import text, bindparam
+from sqlalchemy.sql.elements import TextClause
+import db_pinnacle_remote as db
+from config import TABLE_LEAGUES, TABLE_FIXTURES, TABLE_ODDS, TABLE_BETS, TABLE_USERS, TABLE_SCHEMA_MIGRATIONS
+
+# Every migration is (version, description, steps). A step is ('column', table, column, definition) or ('index', table, name, columns, unique).
+# Steps are idempotent: a column is only added if absent, an index only if no index with the same leading columns exists (i.e. a primary key).
+# Never change an applied migration, append a new version instead.
+MIGRATIONS = (
+    (1, 'Track bet changes for delta refreshes', (
+        ('column', TABLE_BETS, 'updated_at', 'TIMESTAMP(6) NOT NULL DEFAULT CURRENT_TIMESTAMP(6) ON UPDATE CURRENT_TIMESTAMP(6)'),
+        ('index', TABLE_BETS, 'idx_bets_user_updated_at', ('user', 'updated_at'), False),
+    )),
+    (2, 'Indexes of the hot access paths', (
+        # Bets table pages, performance graph & summary: user, then the (starts, id) keyset order
+        ('index', TABLE_BETS, 'idx_bets_user_starts', ('user', 'delete_bet', 'starts', 'id'), False),
+        # Filter facets & filtered bets: covers the GROUP BY of the facet query
+        ('index', TABLE_BETS, 'idx_bets_user_filters', ('user', 'delete_bet', 'sport_name', 'bookmaker', 'tag', 'bet_status', 'starts'), False),
+        # Background purge of deleted bets
+        ('index', TABLE_BETS, 'idx_bets_purge', ('delete_bet', 'updated_at'), False),
+        ('index', TABLE_FIXTURES, 'idx_fixtures_sport_starts', ('sport_id', 'starts'), False),
+        ('index', TABLE_FIXTURES, 'idx_fixtures_event_id', ('event_id',), False),
+        ('index', TABLE_ODDS, 'idx_odds_event_id', ('event_id',), False),
+        ('index', TABLE_LEAGUES, 'idx_leagues_sport_id', ('sport_id',), False),
+        ('index', TABLE_USERS, 'idx_users_username', ('username',), True),
+    )),
+    (3, 'Idempotency keys of added bets', (
+        ('column', TABLE_BETS, 'idempotency_key', 'CHAR(36) NULL'),
+        ('index', TABLE_BETS, 'idx_bets_idempotency_key', ('idempotency_key',), True),
+    )),
+)
+
+QUERY_CREATE_SCHEMA_MIGRATIONS = text(f"CREATE TABLE IF NOT EXISTS {TABLE_SCHEMA_MIGRATIONS} (version INT NOT NULL PRIMARY KEY, description VARCHAR(255) NOT NULL, applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP)")
+QUERY_APPLIED_MIGRATIONS = text(f"SELECT version FROM {TABLE_SCHEMA_MIGRATIONS}")
+QUERY_INSERT_MIGRATION = text(f"INSERT INTO {TABLE_SCHEMA_MIGRATIONS} (version, description) VALUES (:version, :description)")
+QUERY_COLUMN_EXISTS = text("SELECT COUNT(*) FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name AND COLUMN_NAME = :column_name")
+# Rows with NULLs don't conflict in a unique index
+QUERY_DUPLICATES = "SELECT COUNT(*) FROM (SELECT 1 FROM {table_name} WHERE {not_null} GROUP BY {columns} HAVING COUNT(*) > 1) duplicates"
+QUERY_INDEXES = text("SELECT INDEX_NAME, MIN(NON_UNIQUE) AS non_unique, GROUP_CONCAT(COLUMN_NAME ORDER BY SEQ_IN_INDEX) AS columns FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table_name GROUP BY INDEX_NAME")
+# Several deploys may run migrate at once, the lock makes sure only one of them migrates
+QUERY_GET_LOCK = text("SELECT GET_LOCK('schema_migrations', :timeout)")
+QUERY_RELEASE_LOCK = text("SELECT RELEASE_LOCK('schema_migrations')")
+
+# Sample values of the bound parameters of the db_pinnacle_remote statements, only used to EXPLAIN them
+EXPLAIN_PARAMS = dict(dict.fromkeys(db.BET_COLUMNS), username='explain', sport_id=29, starts_from=datetime(2024, 1, 1), starts_to=datetime(2024, 1, 2), contains='%', prefix='%', limit=100, sports=('Soccer',), bookmakers=('Pinnacle',), tags=('',), bet_status=('na',), after_starts=datetime(1970, 1, 1), after_id=0, since=datetime(2024, 1, 1), event_ids=[0], ids=[0], id=0, value=None, user_edit=datetime(2024, 1, 1), batch_size=1000, retention=86400, odds_display='Decimal', timezone='Europe/London', default_sport='Soccer', default_book='Pinnacle', default_tag='')
+EXPANDING_PARAMS = ('sports', 'bookmakers', 'tags', 'bet_status', 'event_ids', 'ids')
+
+
+def column_exists(connection, table_name: str, column_name: str):
+    """
+    :param connection: An open connection.
+    :param table_name: The name of the table.
+    :type table_name: str
+    :param column_name: The name of the column.
+    :type column_name: str
+    :return: True if the table has the column.
+    :rtype: bool
+    """
+    return connection.execute(QUERY_COLUMN_EXISTS, dict(table_name=table_name, column_name=column_name)).scalar() > 0
+
+
+def index_exists(connection, table_name: str, columns: tuple, unique: bool):
+    """
+    :param connection: An open connection.
+    :param table_name: The name of the table.
+    :type table_name: str
+    :param columns: The indexed columns, in index order.
+    :type columns: tuple[str]
+    :param unique: True if the index has to be unique.
+    :type unique: bool
+    :return: True if the table has an index (or primary key) with these leading columns. A unique index has to cover exactly these columns.
+    :rtype: bool
+    """
+    for index_name, non_unique, index_columns in connection.execute(QUERY_INDEXES, dict(table_name=table_name)):
+        index_columns = tuple(index_columns.split(','))
+        if unique and not non_unique and index_columns == tuple(columns):
+            return True
+        if not unique and index_columns[:len(columns)] == tuple(columns):
+            return True
+    return False
+
+
+def count_duplicates(connection, table_name: str, columns: tuple):
+    """
+    :param connection: An open connection.
+    :param table_name: The name of the table.
+    :type table_name: str
+    :param columns: The columns of a unique index.
+    :type columns: tuple[str]
+    :return: The number of values of the columns occurring more than once, i.e. values a unique index can't be added on.
+    :rtype: int
+    """
+    return connection.execute(text(QUERY_DUPLICATES.format(table_name=table_name, columns=', '.join(columns), not_null=' AND '.join(f'{column} IS NOT NULL' for column in columns)))).scalar()
+
+
+def check_steps(connection, version: int, steps: tuple):
+    """
+    Checks that all steps of a migration can be applied before the first one is, so a migration doesn't stop half-applied
+    (MySQL commits every ALTER TABLE). Unique indexes need a table without duplicates, columns added by the same
+    migration are still missing and hold no values yet.
+
+    :param connection: An open connection.
+    :param version: The version of the migration.
+    :type version: int
+    :param steps: The steps of the migration (see MIGRATIONS).
+    :type steps: tuple
+    :return: None
+    """
+    for step in steps:
+        if step[0] == 'index' and step[4] and all(column_exists(connection, step[1], column) for column in step[3]) and not index_exists(connection, step[1], step[3], True):
+            duplicates = count_duplicates(connection, step[1], step[3])
+            if duplicates:
+                raise ValueError(f"Migration {version}: {duplicates} duplicate value(s) of {step[1]} ({', '.join(step[3])}), remove them before adding the unique index {step[2]}")
+
+
+def apply_step(connection, step: tuple):
+    """
+    Applies one migration step unless it is already in place.
+
+    :param connection: An open connection.
+    :param step: ('column', table, column, definition) or ('index', table, name, columns, unique).
+    :type step: tuple
+    :return: True if the step changed the schema.
+    :rtype: bool
+    """
+    if step[0] == 'column':
+        kind, table_name, column_name, definition = step
+        if column_exists(connection, table_name, column_name):
+            return False
+        connection.execute(text(f"ALTER TABLE {table_name} ADD COLUMN {column_name} {definition}"))
+
+    else:
+        kind, table_name, index_name, columns, unique = step
+        if index_exists(connection, table_name, columns, unique):
+            return False
+        connection.execute(text(f"ALTER TABLE {table_name} ADD {'UNIQUE ' if unique else ''}INDEX {index_name} ({', '.join(columns)})"))
+
+    return True
+
+
+def migrate(lock_timeout: int = 600):
+    """
+    Applies all pending migrations in version order and records them in the schema_migrations table.
+
+    :param lock_timeout: The number of seconds to wait for another process migrating at the same time.
+    :type lock_timeout: int
+    :return: The versions applied by this call.
+    :rtype: list[int]
+    """
+    applied = list()
+
+    with db.connect() as connection:
+        if not connection.execute(QUERY_GET_LOCK, dict(timeout=lock_timeout)).scalar():
+            raise TimeoutError('Another process is migrating the schema')
+
+        try:
+            connection.execute(QUERY_CREATE_SCHEMA_MIGRATIONS)
+            done = {version for (version,) in connection.execute(QUERY_APPLIED_MIGRATIONS)}
+
+            for version, description, steps in MIGRATIONS:
+                if version in done:
+                    continue
+                check_steps(connection, version, steps)
+                for step in steps:
+                    apply_step(connection, step)
+                connection.execute(QUERY_INSERT_MIGRATION, dict(version=version, description=description))
+                connection.commit()
+                applied.append(version)
+
+        finally:
+            connection.execute(QUERY_RELEASE_LOCK)
+
+    return applied
+
+
+def get_statements():
+    """
+    :return: All statements of db_pinnacle_remote (the QUERY_* constants, statements held in dictionaries are listed per key).
+    :rtype: dict[str, TextClause]
+    """
+    statements = dict()
+    for name, value in vars(db).items():
+        if name.startswith('QUERY_') and isinstance(value, TextClause):
+            statements[name] = value
+        elif name.startswith('QUERY_') and isinstance(value, dict):
+            statements.update({f'{name}[{key}]': statement for key, statement in value.items() if isinstance(statement, TextClause)})
+    return statements
+
+
+def get_read_statements():
+    """
+    Writes (INSERT, UPDATE, DELETE) are left out, EXPLAIN reports the written table as a full scan.
+
+    :return: The SELECT statements of db_pinnacle_remote, plus the NOT IN and temporary filter table shapes of the bets queries (see db.get_bets_statement).
+    :rtype: dict[str, TextClause]
+    """
+    statements = {name: statement for name, statement in get_statements().items() if statement.text.lstrip().upper().startswith('SELECT')}
+    for query in db.BETS_QUERIES:
+        for operator, from_table in (('NOT IN', False), ('IN', True), ('NOT IN', True)):
+            shape = ((operator, from_table),) * len(db.BETS_LIST_FILTERS)
+            statements[f"BETS_QUERIES[{query}] {operator} {'filter tables' if from_table else 'lists'}"] = db.get_bets_statement(query, shape)
+    return statements
+
+
+def explain(connection, statement: TextClause):
+    """
+    The temporary filter tables the statement reads (see db.FILTER_TABLES) are created empty for the EXPLAIN.
+
+    :param connection: An open connection.
+    :param statement: A statement of db_pinnacle_remote.
+    :type statement: TextClause
+    :return: The rows of the query plan (EXPLAIN output as dictionaries).
+    :rtype: list[dict]
+    """
+    names = set(re.findall(r':(\w+)', statement.text))
+    expanding = [bindparam(name, expanding=True) for name in EXPANDING_PARAMS if name in names]
+    explain_statement = text(f"EXPLAIN {statement.text}").bindparams(*expanding)
+    params = {name: value for name, value in EXPLAIN_PARAMS.items() if name in names}
+    filter_tables = [db.FILTER_TABLES[name] for name in db.FILTER_TABLES if f'filter_{name}' in statement.text]
+
+    for create_table, fill_table, drop_table in filter_tables:
+        connection.execute(create_table)
+    try:
+        return [dict(row) for row in connection.execute(explain_statement, params).mappings()]
+    finally:
+        for create_table, fill_table, drop_table in filter_tables:
+            connection.execute(drop_table)
+
+
+def check_query_plans(allowed: tuple = ()):
+    """
+    Runs EXPLAIN on every read of db_pinnacle_remote and collects the full table scans (access type ALL). Scans of
+    the temporary filter tables and of materialized subqueries (<subqueryN>) are expected and not collected.
+    Run it against a database with production-sized tables, on (nearly) empty tables MySQL prefers full scans.
+
+    :param allowed: Names of statements allowed to scan a full table.
+    :type allowed: tuple[str]
+    :return: A list of (statement name, table) of all full table scans.
+    :rtype: list[tuple[str, str]]
+    """
+    full_scans = list()
+
+    with db.connect() as connection:
+        for name, statement in get_read_statements().items():
+            if name in allowed:
+                continue
+            for row in explain(connection, statement):
+                if row.get('type') == 'ALL' and not str(row.get('table')).startswith(('filter_', '<')):
+                    full_scans.append((name, row.get('table')))
+        connection.rollback()
+
+    return full_scans
+
+
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'check'
+
+    if command == 'migrate':
+        print(f'Applied migrations: {migrate() or "none"}')
+
+    elif command == 'check':
+        full_scans = check_query_plans()
+        for name, table_name in full_scans:
+            print(f'Full table scan: {name} on {table_name}')
+        print(f'{len(get_read_statements())} statements checked, {len(full_scans)} full table scan(s)')
+        sys.exit(1 if full_scans else 0)
+
+    else:
+        sys.exit(f'Unknown command {command}, use migrate or check')
@@ -4,6 +4,7 @@ import streamlit as st
 st.set_page_config(page_title="Track-A-Bet by BettingIsCool", page_icon="🦈", layout="wide", initial_sidebar_state="expanded")
 
 import time
+import uuid
 import pytz
 import math
 import tools
@@ -11,7 +12,10 @@ import datetime
 import pandas as pd
 import db_pinnacle_remote as db
 
-from config import SPORTS, PERIODS, BOOKS, TEXT_LANDING_PAGE
+from config import SPORTS, PERIODS, BOOKS, TEXT_LANDING_PAGE, ADMIN_USERS, FIXTURES_SEARCH_LIMIT, FIXTURES_SEARCH_MAX_DAYS, FIXTURES_BROWSE_MAX_DAYS, STORAGE_TIMEZONE
+
+# Deleted bets are removed by a background worker (one per process). Schema migrations are a deploy step: python schema.py migrate
+db.start_purge_worker()
 
 placeholder1 = st.empty()
 
@@ -37,20 +41,20 @@ username = st.session_state.email
 
 placeholder1.empty()
 
-# Check if username is in database, otherwise append the user
+# Append the user if not in database yet and read the user profile again, another replica may have saved newer settings
 if 'users_fetched' not in st.session_state:
-    tools.clear_cache()
-    if username not in set(db.get_users()):
-        db.append_user(data={'username': username})
-        st.session_state.user_id = username
-        st.session_state.session_id = username + '_' + str(datetime.datetime.now())
+    db.bump_bets_version(username=username)
+    try:
+        db.refresh_user_profile(username=username)
+    except db.DatabaseUnavailableError:
+        st.error(tools.DATABASE_UNAVAILABLE_MESSAGE)
+        st.stop()
 
     # Create session token
-    else:
-        st.session_state.user_id = username
-        st.session_state.session_id = username + '_' + str(datetime.datetime.now())
-        tools.get_active_session.clear()
-        aux_active_session = tools.get_active_session(st.session_state.user_id)
+    st.session_state.user_id = username
+    st.session_state.session_id = username + '_' + str(datetime.datetime.now())
+    tools.get_active_session.clear()
+    aux_active_session = tools.get_active_session(st.session_state.user_id)
 
     st.session_state.users_fetched = True
 
@@ -59,20 +63,23 @@ if 'users_fetched' not in st.session_state:
 
 if st.session_state.session_id == tools.get_active_session(st.session_state.user_id):
 
+    # Reads served from their last result while the database is unavailable set stale_since (see db.guarded_read), the notice is shown at the end of the run
+    st.session_state.stale_since = None
+    stale_notice = st.empty()
+
     # Set odds format
-    if 'odds_display' not in st.session_state:
-        st.session_state.odds_display = db.get_user_odds_display(username=username)[0]
-    if 'timezone' not in st.session_state:
-        st.session_state.timezone = db.get_user_timezone(username=username)[0]
-    if 'default_sport' not in st.session_state:
-        st.session_state.default_sport = db.get_user_default_sport(username=username)[0]
-    if 'default_book' not in st.session_state:
-        st.session_state.default_book = db.get_user_default_book(username=username)[0]
-    if 'default_tag' not in st.session_state:
-        st.session_state.default_tag = db.get_user_default_tag(username=username)[0]
+    # All user preferences are fetched with one (cached) query
+    try:
+        user_profile = db.get_user_profile(username=username)
+    except db.DatabaseUnavailableError:
+        st.error(tools.DATABASE_UNAVAILABLE_MESSAGE)
+        st.stop()
+    for key in ('odds_display', 'timezone', 'default_sport', 'default_book', 'default_tag'):
+        if key not in st.session_state:
+            st.session_state[key] = user_profile[key]
 
     # Initialize bets_to_be_deleted & dataframes
-    bets_to_be_deleted, df = set(), set()
+    bets_to_be_deleted, df, summary, user_facets = set(), set(), None, None
 
     # Welcome message in the sidebar
     st.sidebar.title(f"Welcome {username}")
@@ -80,7 +87,7 @@ if st.session_state.session_id == tools.get_active_session(st.session_state.user
     # st.sidebar.write('Session ID: ', st.session_state.session_id)
 
     # User needs to select sport & date range before fixtures are being fetched from the database
-    col_sport, col_datefrom, col_dateto = st.columns([4, 2, 2])
+    col_sport, col_datefrom, col_dateto, col_search = st.columns([3, 2, 2, 3])
 
     with col_sport:
         selected_sport = st.selectbox(label='Sport', options=SPORTS.keys(), index=list(SPORTS.keys()).index(st.session_state.default_sport), placeholder='Add a bet by selecting a sport', help='41 unique sports supported.')
@@ -91,29 +98,53 @@ if st.session_state.session_id == tools.get_active_session(st.session_state.user
 
         if selected_from_date:
             with col_dateto:
-                selected_to_date = st.date_input(label='End date', value=selected_from_date + datetime.timedelta(days=0), min_value=selected_from_date + datetime.timedelta(days=0), max_value=selected_from_date + datetime.timedelta(days=3), help='Specify what date you want to end your search. Please note that a maximum range of 3 days is allowed to avoid excess server load.')
+                selected_to_date = st.date_input(label='End date', value=selected_from_date + datetime.timedelta(days=0), min_value=selected_from_date + datetime.timedelta(days=0), max_value=selected_from_date + datetime.timedelta(days=FIXTURES_SEARCH_MAX_DAYS - 1), help=f'Specify what date you want to end your search (at most {FIXTURES_SEARCH_MAX_DAYS} days, {FIXTURES_BROWSE_MAX_DAYS} days without a search). You can either use the calendar or manually enter the date, i.e. 2024/08/19.')
 
             # The event_options dictionary represents the event as a concatenated string (starts - league_name - runner_home - runner_away) with the event_id as key
             # This string is what users see in the dropdown menu
             if selected_to_date:
-                # runtime_start = time.time()
+                with col_search:
+                    selected_search = st.text_input(label='Search', value='', max_chars=100, placeholder='League, home or away', help=f'Search fixtures by league, home team or away team, i.e. "premier arsenal". At most {FIXTURES_SEARCH_LIMIT} fixtures with available odds are listed, best matches first.')
 
-                offset = tools.tz_diff(home='Europe/Vienna', away=st.session_state.timezone, on=None)
-                events = db.get_fixtures(sport_id=SPORTS[selected_sport], date_from=datetime.datetime.combine(selected_from_date, datetime.datetime.min.time()) - datetime.timedelta(hours=int(offset)), date_to=datetime.datetime.combine(selected_to_date, datetime.datetime.min.time()) - datetime.timedelta(hours=int(offset)))
+                # runtime_start = time.time()
 
-                # st.write(f"Runtime get_fixtures: {round(time.time() - runtime_start, 3)} seconds.")
+                # The local dates of the user cover this half-open range of storage time
+                starts_from, starts_to = tools.get_storage_range(date_from=selected_from_date, date_to=selected_to_date, timezone=st.session_state.timezone)
+                # Listing all fixtures of a wide range is too expensive, wide ranges need a search
+                # Without fixtures (wide range without a search, database unavailable) the facets are fetched below
+                events = pd.DataFrame(columns=['event_id', 'league_id', 'league_name', 'starts', 'runner_home', 'runner_away'])
+                if not selected_search.strip() and (selected_to_date - selected_from_date).days + 1 > FIXTURES_BROWSE_MAX_DAYS:
+                    st.info(f'Please enter a search to list fixtures of more than {FIXTURES_BROWSE_MAX_DAYS} days.')
+                else:
+                    # The fixtures and the facets for the sidebar filters are independent, fetch them concurrently
+                    try:
+                        results = db.run_concurrently(events=(db.search_fixtures, dict(sport_id=SPORTS[selected_sport], search=selected_search, starts_from=starts_from, starts_to=starts_to)),
+                                                      user_facets=(db.get_user_facets, dict(username=username)))
+                        events, user_facets = results['events'], results['user_facets']
+                    except db.DatabaseUnavailableError:
+                        st.warning(tools.DATABASE_UNAVAILABLE_MESSAGE)
+
+                # st.write(f"Runtime search_fixtures: {round(time.time() - runtime_start, 3)} seconds.")
+                if len(events) >= FIXTURES_SEARCH_LIMIT:
+                    st.info(f'Showing the first {FIXTURES_SEARCH_LIMIT} fixtures only. Please refine your search to find other fixtures.')
+
+                # Warm the odds cache for the top listed events while the user is still choosing
+                db.prefetch_odds(event_ids=events['event_id'].tolist())
 
                 event_options, event_details = dict(), dict()
                 for index, row in events.iterrows():
-                    if row['event_id'] not in event_options.keys():
-                        starts_converted_to_timezone = pytz.timezone('Europe/Vienna').localize(row['starts']).astimezone(pytz.timezone(st.session_state.timezone)).replace(tzinfo=None).strftime('%Y-%m-%d %H:%M')
-                        event_options.update({row['event_id']: f"{starts_converted_to_timezone} {row['league_name'].upper()} {row['runner_home']} - {row['runner_away']}"})
-                        event_details.update({row['event_id']: {'starts': row['starts'].to_pydatetime(), 'league_id': row['league_id'], 'league_name': row['league_name'], 'runner_home': row['runner_home'], 'runner_away': row['runner_away']}})
-                selected_event_id = st.selectbox(label='Event', options=event_options.keys(), index=None, format_func=lambda x: event_options.get(x), placeholder='Add a bet. Start typing...', help="Start searching your fixture by typing any league, home team, away team. Only fixtures with available odds are listed. Please note that corner & booking markets can be found with the respective suffix, i.e. '(Corners)', '(Bookings)'. Tennis markets with games as the resulting unit (i.e. total number of games) can be found with '(Games)' as the suffix.")
+                    starts_converted_to_timezone = tools.to_local_time(row['starts'].to_pydatetime(), st.session_state.timezone).strftime('%Y-%m-%d %H:%M')
+                    event_options.update({row['event_id']: f"{starts_converted_to_timezone} {row['league_name'].upper()} {row['runner_home']} - {row['runner_away']}"})
+                    event_details.update({row['event_id']: {'starts': row['starts'].to_pydatetime(), 'league_id': row['league_id'], 'league_name': row['league_name'], 'runner_home': row['runner_home'], 'runner_away': row['runner_away']}})
+                selected_event_id = st.selectbox(label='Event', options=event_options.keys(), index=None, format_func=lambda x: event_options.get(x), placeholder='Add a bet. Select a fixture or narrow the list with the Search box...', help=f"Use the Search box to find your fixture by league, home team or away team, at most {FIXTURES_SEARCH_LIMIT} fixtures are listed here. Only fixtures with available odds are listed. Please note that corner & booking markets can be found with the respective suffix, i.e. '(Corners)', '(Bookings)'. Tennis markets with games as the resulting unit (i.e. total number of games) can be found with '(Games)' as the suffix.")
 
                 col_market, col_period, col_side, col_line, col_odds, col_stake, col_book, col_tag = st.columns([1, 1, 2, 1, 1, 1, 1, 1])
                 if selected_event_id is not None:
-                    odds = db.get_odds(event_id=selected_event_id)
+                    try:
+                        odds = db.get_odds(event_id=selected_event_id)
+                    except db.DatabaseUnavailableError:
+                        st.warning(tools.DATABASE_UNAVAILABLE_MESSAGE)
+                        odds = pd.DataFrame(columns=['period', 'market', 'line', 'odds1', 'odds0', 'odds2'])
                     with col_market:
                         selected_market = st.selectbox(label='Market', options=odds.market.unique(), index=0, help='Only markets with available odds are listed.')
 
@@ -227,113 +258,156 @@ if st.session_state.session_id == tools.get_active_session(st.session_state.user
                                                     data.update({'raw_line': 0})
                                                     data.update({'line': 0})
 
+                                                # One idempotency key per bet form, a double click submits the same key and the bet is inserted once
+                                                if 'bet_key' not in st.session_state:
+                                                    st.session_state.bet_key, st.session_state.bet_key_used = str(uuid.uuid4()), False
+                                                data.update({'idempotency_key': st.session_state.bet_key})
+
                                                 bet_added = st.button('Add bet')
 
                                                 if bet_added:
-                                                    db.append_bet(data=data)
-                                                    placeholder1.success('Bet added successfully!')
-                                                    st.cache_data.clear()
-                                                    time.sleep(1.5)
-                                                    placeholder1.empty()
+                                                    # Inserted by a background worker, shown in the bets table right away
+                                                    db.queue_bet(data=data)
+                                                    tools.add_pending_bet(data=data)
+                                                    st.session_state.bet_key_used = True
+                                                    st.toast('Bet added successfully!')
+                                                elif st.session_state.bet_key_used:
+                                                    st.session_state.bet_key, st.session_state.bet_key_used = str(uuid.uuid4()), False
+
+    # Bulk import of bets, i.e. tipster histories or model backtests
+    with st.expander('Import bets'):
+        uploaded_file = st.file_uploader(label='CSV or Parquet file', type=['csv', 'parquet'], help='One bet per row. Required columns: event_id, market, period, side, line, odds, stake. Optional columns: bookmaker, tag. Side can be home/draw/away, over/under or odds1/odds0/odds2. The line is ignored for moneyline bets.')
+
+        if uploaded_file is not None and st.button('Import bets'):
+            import_bets, rejected_bets = tools.prepare_bet_import(upload_df=tools.read_bet_import(uploaded_file), username=username, default_book=st.session_state.default_book, default_tag=st.session_state.default_tag)
+
+            import_progress = st.progress(0.0, text='Importing bets...')
+            imported = db.append_bets(bets=import_bets, progress=lambda done, total: import_progress.progress(done / total, text=f'{done} / {total} bets imported'))
+            user_facets = None  # Fetched before the bets were imported
+            st.success(f'{imported} bet(s) imported successfully! Bets imported before are skipped.')
+
+            if not rejected_bets.empty:
+                st.warning(f'{len(rejected_bets)} row(s) rejected.')
+                st.dataframe(rejected_bets, hide_index=True)
 
     # Apply filter to recorded bets
-    user_unique_sports = db.get_user_unique_sports(username=username)
-    selected_sports = st.sidebar.multiselect(label='Sports', options=sorted(user_unique_sports), default=user_unique_sports)
-    selected_sports = [f"'{s}'" for s in selected_sports]
-    selected_sports = f"({','.join(selected_sports)})"
-
-    weighted_average_odds = 1.00
-    if selected_sports != '()':
-        user_unique_bookmakers = db.get_user_unique_bookmakers(username=username, sports=selected_sports)
-        selected_bookmakers = st.sidebar.multiselect(label='Bookmakers', options=sorted(user_unique_bookmakers), default=user_unique_bookmakers)
-        selected_bookmakers = [f"'{s}'" for s in selected_bookmakers]
-        selected_bookmakers = f"({','.join(selected_bookmakers)})"
-
-        if selected_bookmakers != '()':
-            user_unique_tags = db.get_user_unique_tags(username=username, sports=selected_sports, bookmakers=selected_bookmakers)
-            selected_tags = st.sidebar.multiselect(label='Tags', options=sorted(user_unique_tags), default=user_unique_tags)
-            selected_tags = [f"'{s}'" for s in selected_tags]
-            selected_tags = f"({','.join(selected_tags)})"
-
-            if selected_tags != '()':
-                user_unique_bet_status = db.get_user_unique_bet_status(username=username, sports=selected_sports, bookmakers=selected_bookmakers, tags=selected_tags)
-                selected_bet_status = st.sidebar.multiselect(label='Status', options=sorted(user_unique_bet_status), default=user_unique_bet_status, help='Select the bet status. W = Won, HW = Half Won, L = Lost, HL = Half Lost, P = Push, V = Void, na = ungraded')
-                selected_bet_status = [f"'{s}'" for s in selected_bet_status]
-                selected_bet_status = f"({','.join(selected_bet_status)})"
-
-                if selected_bet_status != '()':
-                    user_unique_starts = db.get_user_unique_starts(username=username, sports=selected_sports, bookmakers=selected_bookmakers, tags=selected_tags, bet_status=selected_bet_status)
-
-                    if user_unique_starts is not None:
-                        selected_date_from = st.sidebar.date_input(label='Start', value=min(user_unique_starts), min_value=min(user_unique_starts), max_value=max(user_unique_starts), help='Specify the start date for analysis. You can either use the calendar or manually enter the date, i.e. 2024/08/19.')
-                        selected_date_to = st.sidebar.date_input(label='End', value=max(user_unique_starts), min_value=min(user_unique_starts), max_value=max(user_unique_starts), help='Specify the end date for analysis. You can either use the calendar or manually enter the date, i.e. 2024/08/19.')
-
-                        bets = db.get_bets(username=username, sports=selected_sports, bookmakers=selected_bookmakers, tags=selected_tags, bet_status=selected_bet_status, date_from=selected_date_from, date_to=selected_date_to)
-                        bets_df = pd.DataFrame(data=bets)
-
-                        # Convert datetimes to user timezone
-                        # There is a possibility that the conversion fails if the timestamp falls into a time change
-                        # See https://github.com/streamlit/streamlit/issues/1288
+    # The cascading filters are computed in memory from one facet query per user
+    if user_facets is None:
+        try:
+            user_facets = db.get_user_facets(username=username)
+        except db.DatabaseUnavailableError:
+            st.sidebar.warning(tools.DATABASE_UNAVAILABLE_MESSAGE)
+            user_facets = pd.DataFrame(columns=['sport_name', 'bookmaker', 'tag', 'bet_status', 'bets', 'starts_min', 'starts_max'])
+    user_unique_sports = tools.get_facet_options(user_facets, 'sport_name')
+    selected_sports = tuple(st.sidebar.multiselect(label='Sports', options=sorted(user_unique_sports), default=user_unique_sports))
+
+    if selected_sports:
+        user_unique_bookmakers = tools.get_facet_options(user_facets, 'bookmaker', sport_name=selected_sports)
+        selected_bookmakers = tuple(st.sidebar.multiselect(label='Bookmakers', options=sorted(user_unique_bookmakers), default=user_unique_bookmakers))
+
+        if selected_bookmakers:
+            user_unique_tags = tools.get_facet_options(user_facets, 'tag', sport_name=selected_sports, bookmaker=selected_bookmakers)
+            selected_tags = tuple(st.sidebar.multiselect(label='Tags', options=sorted(user_unique_tags), default=user_unique_tags))
+
+            if selected_tags:
+                user_unique_bet_status = tools.get_facet_options(user_facets, 'bet_status', sport_name=selected_sports, bookmaker=selected_bookmakers, tag=selected_tags)
+                selected_bet_status = tuple(st.sidebar.multiselect(label='Status', options=sorted(user_unique_bet_status), default=user_unique_bet_status, help='Select the bet status. W = Won, HW = Half Won, L = Lost, HL = Half Lost, P = Push, V = Void, na = ungraded'))
+
+                if selected_bet_status:
+                    min_starts, max_starts = tools.get_facet_date_range(user_facets, timezone=st.session_state.timezone, sport_name=selected_sports, bookmaker=selected_bookmakers, tag=selected_tags, bet_status=selected_bet_status)
+
+                    if min_starts is not None:
+                        selected_date_from = st.sidebar.date_input(label='Start', value=min_starts, min_value=min_starts, max_value=max_starts, help='Specify the start date for analysis. You can either use the calendar or manually enter the date, i.e. 2024/08/19.')
+                        selected_date_to = st.sidebar.date_input(label='End', value=max_starts, min_value=min_starts, max_value=max_starts, help='Specify the end date for analysis. You can either use the calendar or manually enter the date, i.e. 2024/08/19.')
+
+                        # The bets table is loaded page by page (further pages on demand), the stats always cover all filtered bets
+                        # The selected local dates are converted once into a half-open range of storage time
+                        starts_from, starts_to = tools.get_storage_range(date_from=selected_date_from, date_to=selected_date_to, timezone=st.session_state.timezone)
+                        # Each list filter is sent in its most compact form, omitted if everything is selected
+                        bets_filter = dict(sports=tools.encode_filter(selected_sports, user_unique_sports), bookmakers=tools.encode_filter(selected_bookmakers, user_unique_bookmakers), tags=tools.encode_filter(selected_tags, user_unique_tags), bet_status=tools.encode_filter(selected_bet_status, user_unique_bet_status), starts_from=starts_from, starts_to=starts_to)
+                        if st.session_state.get('bets_filter') != bets_filter:
+                            st.session_state.bets_filter, st.session_state.bets_pages = bets_filter, 1
+
+                        # Merge the user's own writes into the bets table of the session before the stats are queried
+                        tools.sync_bets(username=username)
                         try:
-                            bets_df.starts = bets_df.starts.dt.tz_localize('Europe/Vienna').dt.tz_convert(st.session_state.timezone).dt.tz_localize(None)
-                        except Exception as ex:
-                            pass
-
-                        try:
-                            bets_df.bet_added = bets_df.bet_added.dt.tz_localize('Europe/Vienna').dt.tz_convert(st.session_state.timezone).dt.tz_localize(None)
-                        except Exception as ex:
-                            pass
-
-                        bets_df = bets_df.rename(columns={'delete_bet': 'DEL', 'id': 'ID', 'tag': 'TAG', 'starts': 'STARTS', 'sport_name': 'SPORT', 'league_name': 'LEAGUE', 'runner_home': 'RUNNER_HOME', 'runner_away': 'RUNNER_AWAY', 'market': 'MARKET', 'period_name': 'PERIOD', 'side_name': 'SIDE', 'line': 'LINE', 'odds': 'ODDS', 'stake': 'STAKE', 'bookmaker': 'BOOK', 'bet_status': 'ST', 'score_home': 'SH', 'score_away': 'SA', 'profit': 'P/L', 'cls_odds': 'CLS', 'true_cls': 'CLS_TRUE', 'cls_limit': 'CLS_LIMIT', 'ev': 'EXP_WIN', 'clv': 'CLV', 'bet_added': 'BET_ADDED'})
-                        bets_df = bets_df[['DEL', 'TAG', 'STARTS', 'SPORT', 'LEAGUE', 'RUNNER_HOME', 'RUNNER_AWAY', 'MARKET', 'PERIOD', 'SIDE', 'LINE', 'ODDS', 'STAKE', 'ST', 'SH', 'SA', 'P/L', 'CLS', 'CLS_TRUE', 'CLS_LIMIT', 'EXP_WIN', 'CLV', 'BOOK', 'BET_ADDED', 'ID']]
-
-                        # Calculate weighhted average odds (using decimal odds)
-                        sumprod_odds_stake = 0.00
-                        for index, row in bets_df.iterrows():
-                            sumprod_odds_stake += row['ODDS'] * row['STAKE']
-                        weighted_average_odds = sumprod_odds_stake / bets_df['STAKE'].sum()
-
-                        # Apply font & background colors to cells, apply number formatting
-                        if st.session_state.odds_display == 'American':
-                            bets_df.ODDS = bets_df.ODDS.apply(tools.get_american_odds)
-                            bets_df.CLS = bets_df.CLS.apply(tools.get_american_odds)
-                            bets_df.CLS_TRUE = bets_df.CLS_TRUE.apply(tools.get_american_odds)
-                            styled_df = bets_df.style.applymap(tools.color_cells, subset=['ST', 'P/L', 'EXP_WIN', 'CLV']).format({'LINE': '{:g}'.format, 'ODDS': '{0:g}'.format, 'STAKE': '{:,.2f}'.format, 'P/L': '{:,.2f}'.format, 'CLS': '{0:g}'.format, 'CLS_TRUE': '{0:g}'.format, 'CLS_LIMIT': '{:,.0f}'.format, 'EXP_WIN': '{:,.2f}'.format, 'CLV': '{:,.2%}'.format, 'SH': '{0:g}'.format, 'SA': '{0:g}'.format})
-                        else:
-                            styled_df = bets_df.style.applymap(tools.color_cells, subset=['ST', 'P/L', 'EXP_WIN', 'CLV']).format({'LINE': '{:g}'.format, 'ODDS': '{:,.3f}'.format, 'STAKE': '{:,.2f}'.format, 'P/L': '{:,.2f}'.format, 'CLS': '{:,.3f}'.format, 'CLS_TRUE': '{:,.3f}'.format, 'CLS_LIMIT': '{:,.0f}'.format, 'EXP_WIN': '{:,.2f}'.format, 'CLV': '{:,.2%}'.format, 'SH': '{0:g}'.format, 'SA': '{0:g}'.format})
-                            pd.set_option("styler.render.max_elements", 33333333)
-
-                        # START - Option with editable dataframe
-                        if 'initial_df' not in st.session_state:
-                            st.session_state['initial_df'] = placeholder1.data_editor(styled_df, column_config={"DEL": st.column_config.CheckboxColumn("DEL", help="Select if you want to delete this bet.", default=False), "ST": st.column_config.TextColumn("ST", help="Bet Status. W = Won, HW = Half Won, L = Lost, HL = Half Lost, P = Push, V = Void, na = ungraded. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True), "TAG": st.column_config.TextColumn("TAG", help="Tag your bets to classify them for future research, i.e. apply a tag filter. This could be a particular strategy, model or a tipster, etc. You can edit the value with a double-click on the cell."), "SH": st.column_config.NumberColumn("SH", help="Score Home. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=0, max_value=1000, step=1), "P/L": st.column_config.NumberColumn("P/L", help="Actual profit. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=-1000000, max_value=1000000, step=0.01), "SA": st.column_config.NumberColumn("SA", help="Score Away. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=0, max_value=1000, step=1), "STARTS": st.column_config.DatetimeColumn("STARTS", help="Event starting time"), "SPORT": st.column_config.TextColumn("SPORT", help="Sport"), "LEAGUE": st.column_config.TextColumn("LEAGUE", help="League"), "RUNNER_HOME": st.column_config.TextColumn("RUNNER_HOME", help="Home Team/Player 1"), "RUNNER_AWAY": st.column_config.TextColumn("RUNNER_AWAY", help="Away Team/Player 2"), "MARKET": st.column_config.TextColumn("MARKET", help="Market. This can be one of the following: MONEYLINE, SPREAD, TOTALS, HOME_TOTALS, AWAY_TOTALS"), "PERIOD": st.column_config.TextColumn("PERIOD", help="Period. This refers to the game section of the bet, i.e. fulltime, halftime, 1st quarter, etc."), "SIDE": st.column_config.TextColumn("SIDE", help="Selection"), "LINE": st.column_config.NumberColumn("LINE", help="Line refers to the handicap for spread & totals markets."), "ODDS": st.column_config.NumberColumn("ODDS", help="Obtained price"), "STAKE": st.column_config.NumberColumn("STAKE", help="Risk amount"), "BOOK": st.column_config.TextColumn("BOOK", help="Bookmaker. You can edit the value with a double-click on the cell."), "CLS": st.column_config.NumberColumn("CLS", help="Closing price"), "CLS_TRUE": st.column_config.NumberColumn("CLS_TRUE", help="Closing price with bookmaker margin removed (= no-vig closing odds)"), "CLS_LIMIT": st.column_config.NumberColumn("CLS_LIMIT", help="Maximum bet size at closing"), "EXP_WIN": st.column_config.NumberColumn("EXP_WIN", help="Expected Win. This is the expected value of your bet. This figure compares obtained odds with no-vig closing odds and takes into account the stake. Quality bets will typically have an exp_win > 0."), "CLV": st.column_config.NumberColumn("CLV", help="Closing line value. This is the expected roi of your bet. This figure compares obtained odds with no-vig closing odds. Quality bets will typically have a clv > 0."), "BET_ADDED": st.column_config.DatetimeColumn("BET_ADDED", help="Timestamp of the recorded bet.")}, disabled=['STARTS', 'SPORT', 'LEAGUE', 'RUNNER_HOME', 'RUNNER_AWAY', 'MARKET', 'PERIOD', 'SIDE', 'LINE', 'ODDS', 'CLS', 'CLS_TRUE', 'CLS_LIMIT', 'EXP_WIN', 'CLV', 'BET_ADDED', 'ID', 'STAKE'], key='initial_df_key', hide_index=True)
-                            placeholder1.empty()
-
-                        st.session_state['edited_df'] = st.data_editor(styled_df, column_config={"DEL": st.column_config.CheckboxColumn("DEL", help="Select if you want to delete this bet.", default=False), "ST": st.column_config.TextColumn("ST", help="Bet Status. W = Won, HW = Half Won, L = Lost, HL = Half Lost, P = Push, V = Void, na = ungraded. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True), "TAG": st.column_config.TextColumn("TAG", help="Tag your bets to classify them for future research, i.e. apply a tag filter. This could be a particular strategy, model or a tipster, etc. You can edit the value with a double-click on the cell."), "SH": st.column_config.NumberColumn("SH", help="Score Home. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=0, max_value=1000, step=1), "P/L": st.column_config.NumberColumn("P/L", help="Actual profit. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=-1000000, max_value=1000000, step=0.01), "SA": st.column_config.NumberColumn("SA", help="Score Away. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=0, max_value=1000, step=1), "STARTS": st.column_config.DatetimeColumn("STARTS", help="Event starting time"), "SPORT": st.column_config.TextColumn("SPORT", help="Sport"), "LEAGUE": st.column_config.TextColumn("LEAGUE", help="League"), "RUNNER_HOME": st.column_config.TextColumn("RUNNER_HOME", help="Home Team/Player 1"), "RUNNER_AWAY": st.column_config.TextColumn("RUNNER_AWAY", help="Away Team/Player 2"), "MARKET": st.column_config.TextColumn("MARKET", help="Market. This can be one of the following: MONEYLINE, SPREAD, TOTALS, HOME_TOTALS, AWAY_TOTALS"), "PERIOD": st.column_config.TextColumn("PERIOD", help="Period. This refers to the game section of the bet, i.e. fulltime, halftime, 1st quarter, etc."), "SIDE": st.column_config.TextColumn("SIDE", help="Selection"), "LINE": st.column_config.NumberColumn("LINE", help="Line refers to the handicap for spread & totals markets."), "ODDS": st.column_config.NumberColumn("ODDS", help="Obtained price"), "STAKE": st.column_config.NumberColumn("STAKE", help="Risk amount"), "BOOK": st.column_config.TextColumn("BOOK", help="Bookmaker. You can edit the value with a double-click on the cell."), "CLS": st.column_config.NumberColumn("CLS", help="Closing price"), "CLS_TRUE": st.column_config.NumberColumn("CLS_TRUE", help="Closing price with bookmaker margin removed (= no-vig closing odds)"), "CLS_LIMIT": st.column_config.NumberColumn("CLS_LIMIT", help="Maximum bet size at closing"), "EXP_WIN": st.column_config.NumberColumn("EXP_WIN", help="Expected Win. This is the expected value of your bet. This figure compares obtained odds with no-vig closing odds and takes into account the stake. Quality bets will typically have an exp_win > 0."), "CLV": st.column_config.NumberColumn("CLV", help="Closing line value. This is the expected roi of your bet. This figure compares obtained odds with no-vig closing odds. Quality bets will typically have a clv > 0."), "BET_ADDED": st.column_config.DatetimeColumn("BET_ADDED", help="Timestamp of the recorded bet.")}, disabled=['STARTS', 'SPORT', 'LEAGUE', 'RUNNER_HOME', 'RUNNER_AWAY', 'MARKET', 'PERIOD', 'SIDE', 'LINE', 'ODDS', 'CLS', 'CLS_TRUE', 'CLS_LIMIT', 'EXP_WIN', 'CLV', 'BET_ADDED', 'ID', 'STAKE'], key='edited_df_key', hide_index=True)
-
-                        if not st.session_state['initial_df'].equals(st.session_state['edited_df']):
-
-                            tools.update_bet(initial_df=st.session_state['initial_df'], edited_df=st.session_state['edited_df'], placeholder=placeholder1)
-                            st.session_state['initial_df'] = st.session_state['edited_df']
-                            st.rerun()
-
-                        df = st.session_state['edited_df']
-                        # END - Option with editable dataframe
-
-                        bets_to_be_deleted = df.loc[(df['DEL'] == True), 'ID'].tolist()
+                            results = db.run_concurrently(bets_frame=(tools.load_session_bets, dict(frame=st.session_state.get('bets_frame'), username=username, pages=st.session_state.bets_pages, **bets_filter)), summary=(db.get_bet_summary, dict(username=username, **bets_filter)), stats=(db.get_bets_performance, dict(username=username, **bets_filter)))
+                        except db.DatabaseUnavailableError:
+                            st.warning(tools.DATABASE_UNAVAILABLE_MESSAGE)
+                            results = None
+
+                        if results is not None:
+                            st.session_state.bets_frame, summary, stats_df = results['bets_frame'], results['summary'], results['stats']
+                            # A copy, the timezones of the table are converted in place below
+                            bets_df, all_bets_loaded = st.session_state.bets_frame['bets'].copy(), st.session_state.bets_frame['all_loaded']
+
+                            # Convert datetimes to user timezone
+                            # There is a possibility that the conversion fails if the timestamp falls into a time change
+                            # See https://github.com/streamlit/streamlit/issues/1288
+                            try:
+                                bets_df.starts = bets_df.starts.dt.tz_localize(STORAGE_TIMEZONE).dt.tz_convert(st.session_state.timezone).dt.tz_localize(None)
+                            except Exception as ex:
+                                pass
+
+                            try:
+                                bets_df.bet_added = bets_df.bet_added.dt.tz_localize(STORAGE_TIMEZONE).dt.tz_convert(st.session_state.timezone).dt.tz_localize(None)
+                            except Exception as ex:
+                                pass
+
+                            bets_df = bets_df.rename(columns={'delete_bet': 'DEL', 'id': 'ID', 'tag': 'TAG', 'starts': 'STARTS', 'sport_name': 'SPORT', 'league_name': 'LEAGUE', 'runner_home': 'RUNNER_HOME', 'runner_away': 'RUNNER_AWAY', 'market': 'MARKET', 'period_name': 'PERIOD', 'side_name': 'SIDE', 'line': 'LINE', 'odds': 'ODDS', 'stake': 'STAKE', 'bookmaker': 'BOOK', 'bet_status': 'ST', 'score_home': 'SH', 'score_away': 'SA', 'profit': 'P/L', 'cls_odds': 'CLS', 'true_cls': 'CLS_TRUE', 'cls_limit': 'CLS_LIMIT', 'ev': 'EXP_WIN', 'clv': 'CLV', 'bet_added': 'BET_ADDED'})
+                            bets_df = bets_df[['DEL', 'TAG', 'STARTS', 'SPORT', 'LEAGUE', 'RUNNER_HOME', 'RUNNER_AWAY', 'MARKET', 'PERIOD', 'SIDE', 'LINE', 'ODDS', 'STAKE', 'ST', 'SH', 'SA', 'P/L', 'CLS', 'CLS_TRUE', 'CLS_LIMIT', 'EXP_WIN', 'CLV', 'BOOK', 'BET_ADDED', 'ID']]
+
+                            # Editable text columns are plain strings, the data editor would offer categoricals as a fixed selection
+                            bets_df = bets_df.astype({'TAG': object, 'BOOK': object, 'ST': object})
+
+                            # Apply font & background colors to cells, apply number formatting
+                            if st.session_state.odds_display == 'American':
+                                # Odds are float32, round back to the 3 decimals of the entered odds before converting
+                                bets_df.ODDS = bets_df.ODDS.astype(float).round(3).apply(tools.get_american_odds)
+                                bets_df.CLS = bets_df.CLS.astype(float).round(3).apply(tools.get_american_odds)
+                                bets_df.CLS_TRUE = bets_df.CLS_TRUE.astype(float).round(3).apply(tools.get_american_odds)
+                                styled_df = bets_df.style.applymap(tools.color_cells, subset=['ST', 'P/L', 'EXP_WIN', 'CLV']).format({'LINE': '{:g}'.format, 'ODDS': '{0:g}'.format, 'STAKE': '{:,.2f}'.format, 'P/L': '{:,.2f}'.format, 'CLS': '{0:g}'.format, 'CLS_TRUE': '{0:g}'.format, 'CLS_LIMIT': '{:,.0f}'.format, 'EXP_WIN': '{:,.2f}'.format, 'CLV': '{:,.2%}'.format, 'SH': '{0:g}'.format, 'SA': '{0:g}'.format})
+                            else:
+                                styled_df = bets_df.style.applymap(tools.color_cells, subset=['ST', 'P/L', 'EXP_WIN', 'CLV']).format({'LINE': '{:g}'.format, 'ODDS': '{:,.3f}'.format, 'STAKE': '{:,.2f}'.format, 'P/L': '{:,.2f}'.format, 'CLS': '{:,.3f}'.format, 'CLS_TRUE': '{:,.3f}'.format, 'CLS_LIMIT': '{:,.0f}'.format, 'EXP_WIN': '{:,.2f}'.format, 'CLV': '{:,.2%}'.format, 'SH': '{0:g}'.format, 'SA': '{0:g}'.format})
+                                pd.set_option("styler.render.max_elements", 33333333)
+
+                            # START - Option with editable dataframe
+                            if 'initial_df' not in st.session_state:
+                                st.session_state['initial_df'] = placeholder1.data_editor(styled_df, column_config={"DEL": st.column_config.CheckboxColumn("DEL", help="Select if you want to delete this bet.", default=False), "ST": st.column_config.TextColumn("ST", help="Bet Status. W = Won, HW = Half Won, L = Lost, HL = Half Lost, P = Push, V = Void, na = ungraded. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True), "TAG": st.column_config.TextColumn("TAG", help="Tag your bets to classify them for future research, i.e. apply a tag filter. This could be a particular strategy, model or a tipster, etc. You can edit the value with a double-click on the cell."), "SH": st.column_config.NumberColumn("SH", help="Score Home. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=0, max_value=1000, step=1), "P/L": st.column_config.NumberColumn("P/L", help="Actual profit. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=-1000000, max_value=1000000, step=0.01), "SA": st.column_config.NumberColumn("SA", help="Score Away. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=0, max_value=1000, step=1), "STARTS": st.column_config.DatetimeColumn("STARTS", help="Event starting time"), "SPORT": st.column_config.TextColumn("SPORT", help="Sport"), "LEAGUE": st.column_config.TextColumn("LEAGUE", help="League"), "RUNNER_HOME": st.column_config.TextColumn("RUNNER_HOME", help="Home Team/Player 1"), "RUNNER_AWAY": st.column_config.TextColumn("RUNNER_AWAY", help="Away Team/Player 2"), "MARKET": st.column_config.TextColumn("MARKET", help="Market. This can be one of the following: MONEYLINE, SPREAD, TOTALS, HOME_TOTALS, AWAY_TOTALS"), "PERIOD": st.column_config.TextColumn("PERIOD", help="Period. This refers to the game section of the bet, i.e. fulltime, halftime, 1st quarter, etc."), "SIDE": st.column_config.TextColumn("SIDE", help="Selection"), "LINE": st.column_config.NumberColumn("LINE", help="Line refers to the handicap for spread & totals markets."), "ODDS": st.column_config.NumberColumn("ODDS", help="Obtained price"), "STAKE": st.column_config.NumberColumn("STAKE", help="Risk amount"), "BOOK": st.column_config.TextColumn("BOOK", help="Bookmaker. You can edit the value with a double-click on the cell."), "CLS": st.column_config.NumberColumn("CLS", help="Closing price"), "CLS_TRUE": st.column_config.NumberColumn("CLS_TRUE", help="Closing price with bookmaker margin removed (= no-vig closing odds)"), "CLS_LIMIT": st.column_config.NumberColumn("CLS_LIMIT", help="Maximum bet size at closing"), "EXP_WIN": st.column_config.NumberColumn("EXP_WIN", help="Expected Win. This is the expected value of your bet. This figure compares obtained odds with no-vig closing odds and takes into account the stake. Quality bets will typically have an exp_win > 0."), "CLV": st.column_config.NumberColumn("CLV", help="Closing line value. This is the expected roi of your bet. This figure compares obtained odds with no-vig closing odds. Quality bets will typically have a clv > 0."), "BET_ADDED": st.column_config.DatetimeColumn("BET_ADDED", help="Timestamp of the recorded bet.")}, disabled=['STARTS', 'SPORT', 'LEAGUE', 'RUNNER_HOME', 'RUNNER_AWAY', 'MARKET', 'PERIOD', 'SIDE', 'LINE', 'ODDS', 'CLS', 'CLS_TRUE', 'CLS_LIMIT', 'EXP_WIN', 'CLV', 'BET_ADDED', 'ID', 'STAKE'], key='initial_df_key', hide_index=True)
+                                placeholder1.empty()
+
+                            st.session_state['edited_df'] = st.data_editor(styled_df, column_config={"DEL": st.column_config.CheckboxColumn("DEL", help="Select if you want to delete this bet.", default=False), "ST": st.column_config.TextColumn("ST", help="Bet Status. W = Won, HW = Half Won, L = Lost, HL = Half Lost, P = Push, V = Void, na = ungraded. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True), "TAG": st.column_config.TextColumn("TAG", help="Tag your bets to classify them for future research, i.e. apply a tag filter. This could be a particular strategy, model or a tipster, etc. You can edit the value with a double-click on the cell."), "SH": st.column_config.NumberColumn("SH", help="Score Home. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=0, max_value=1000, step=1), "P/L": st.column_config.NumberColumn("P/L", help="Actual profit. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=-1000000, max_value=1000000, step=0.01), "SA": st.column_config.NumberColumn("SA", help="Score Away. This will be settled automatically. Please be patient, this can take up to several hours. On rare occasions it is possible that the payout or grading you received from your sportsbook is different (i.e. due to divergent settlement rules if a match is abandoned or due to a retirement of a player). You can edit the value by double-clicking on the cell.", required=True, min_value=0, max_value=1000, step=1), "STARTS": st.column_config.DatetimeColumn("STARTS", help="Event starting time"), "SPORT": st.column_config.TextColumn("SPORT", help="Sport"), "LEAGUE": st.column_config.TextColumn("LEAGUE", help="League"), "RUNNER_HOME": st.column_config.TextColumn("RUNNER_HOME", help="Home Team/Player 1"), "RUNNER_AWAY": st.column_config.TextColumn("RUNNER_AWAY", help="Away Team/Player 2"), "MARKET": st.column_config.TextColumn("MARKET", help="Market. This can be one of the following: MONEYLINE, SPREAD, TOTALS, HOME_TOTALS, AWAY_TOTALS"), "PERIOD": st.column_config.TextColumn("PERIOD", help="Period. This refers to the game section of the bet, i.e. fulltime, halftime, 1st quarter, etc."), "SIDE": st.column_config.TextColumn("SIDE", help="Selection"), "LINE": st.column_config.NumberColumn("LINE", help="Line refers to the handicap for spread & totals markets."), "ODDS": st.column_config.NumberColumn("ODDS", help="Obtained price"), "STAKE": st.column_config.NumberColumn("STAKE", help="Risk amount"), "BOOK": st.column_config.TextColumn("BOOK", help="Bookmaker. You can edit the value with a double-click on the cell."), "CLS": st.column_config.NumberColumn("CLS", help="Closing price"), "CLS_TRUE": st.column_config.NumberColumn("CLS_TRUE", help="Closing price with bookmaker margin removed (= no-vig closing odds)"), "CLS_LIMIT": st.column_config.NumberColumn("CLS_LIMIT", help="Maximum bet size at closing"), "EXP_WIN": st.column_config.NumberColumn("EXP_WIN", help="Expected Win. This is the expected value of your bet. This figure compares obtained odds with no-vig closing odds and takes into account the stake. Quality bets will typically have an exp_win > 0."), "CLV": st.column_config.NumberColumn("CLV", help="Closing line value. This is the expected roi of your bet. This figure compares obtained odds with no-vig closing odds. Quality bets will typically have a clv > 0."), "BET_ADDED": st.column_config.DatetimeColumn("BET_ADDED", help="Timestamp of the recorded bet.")}, disabled=['STARTS', 'SPORT', 'LEAGUE', 'RUNNER_HOME', 'RUNNER_AWAY', 'MARKET', 'PERIOD', 'SIDE', 'LINE', 'ODDS', 'CLS', 'CLS_TRUE', 'CLS_LIMIT', 'EXP_WIN', 'CLV', 'BET_ADDED', 'ID', 'STAKE'], key='edited_df_key', hide_index=True)
+
+                            if not st.session_state['initial_df'].equals(st.session_state['edited_df']):
+
+                                tools.update_bets(initial_df=st.session_state['initial_df'], edited_df=st.session_state['edited_df'], username=username)
+                                st.session_state['initial_df'] = st.session_state['edited_df']
+                                st.rerun()
+
+                            df = st.session_state['edited_df']
+                            # END - Option with editable dataframe
+
+                            if not all_bets_loaded:
+                                st.button('Load more bets', help=f'Showing the first {len(bets_df)} bets. Stats & graph always include all filtered bets.', on_click=tools.load_more_bets)
+
+                            bets_to_be_deleted = df.loc[(df['DEL'] == True), 'ID'].tolist()
 
     # Place Refresh & Delete button below dataframe
     # Delete button will only be visible if at least one event is selected
-    st.button('Refresh', help='Use this refresh button to update the dataframe. If you are refreshing your browser you will be logged out.', on_click=tools.clear_cache)
+    st.button('Refresh', help='Use this refresh button to update the dataframe. If you are refreshing your browser you will be logged out.', on_click=tools.sync_bets, args=(username, True))
     if bets_to_be_deleted:
-        st.button('Delete selected bet(s)', on_click=tools.delete_bets, args=(bets_to_be_deleted,), type="primary")
+        st.button('Delete selected bet(s)', on_click=tools.delete_bets, args=(username, bets_to_be_deleted), type="primary")
 
-    # Display stats
-    if len(df) > 0:
+    # Display stats (aggregated in the database)
+    if summary is not None and summary['turnover'] > 0:
 
-        bet_count = len(df[df['ST'] != 'na'])
-        turnover = df.loc[df['ST'] != 'na', 'STAKE'].sum()
-        sum_profit = df['P/L'].sum()
-        sum_ev = df['EXP_WIN'].sum()
+        bet_count = int(summary['bets'])
+        turnover = summary['turnover']
+        sum_profit = summary['sum_profit']
+        sum_ev = summary['sum_ev']
+
+        # Calculate weighhted average odds (using decimal odds)
+        weighted_average_odds = summary['sum_odds_stake'] / summary['sum_stake']
         act_roi = sum_profit / turnover
         clv = sum_ev / turnover
 
@@ -355,36 +429,33 @@ if st.session_state.session_id == tools.get_active_session(st.session_state.user
 
             st.subheader(f"EXP P/L: {color_ev}[{round(sum_ev, 2):+g}] - EXP ROI (CLV): {color_clv}[{round(100 * clv, 2):+g}%] - LUCK METER: :{color_luck_factor}[{luck_factor:{format_luck_factor}}] :{color_luck_factor}[({comment_luck_factor})] - RATING: :{color_rating}[{rating}] :{color_rating}[({comment_rating})]", help='LUCK FACTOR gives you an idea of how lucky/unlucky you were with the results of your bets. This figure ranges from -3 (extremely unlucky) to +3 (extremely lucky) and is measured by how many standard deviations your actual roi is away from the mean. RATING indicates the quality of your bets, i.e. if they are +ev on average or not. This figure ranges from A (excellent) to F (terrible) and is based on the expected roi. This is the most important figure and should be monitored closely.')
 
-            cum_profit, cum_clv, cum_bets, cur_profit, cur_clv, cur_bets = list(), list(), list(), 0.00, 0.00, 0
-            for index, row in df.iterrows():
-                if row['ST'] != 'na':
-                    cur_profit += row['P/L']
-                    cur_clv += row['EXP_WIN']
-                    cur_bets += 1
-
-                    cum_profit.append(cur_profit)
-                    cum_clv.append(cur_clv)
-                    cum_bets.append(cur_bets)
-
-            chart_data = pd.DataFrame({"bet_no": cum_bets, "Actual P/L": cum_profit, "Expected P/L": cum_clv}, columns=["bet_no", "Actual P/L", "Expected P/L"])
+            chart_data = pd.DataFrame({"bet_no": range(1, len(stats_df) + 1), "Actual P/L": stats_df['profit'].cumsum().to_numpy(), "Expected P/L": stats_df['ev'].cumsum().to_numpy()}, columns=["bet_no", "Actual P/L", "Expected P/L"])
             st.line_chart(chart_data, x="bet_no", y=["Actual P/L", "Expected P/L"], x_label='Bet no', y_label='Actual vs expected profit', color=["#FF0000", "#FFA500"], height=800)
 
     # Create a radio button for Decimal/American odds format
     odds_display_options = ['Decimal', 'American']
-    st.session_state.odds_display = st.sidebar.radio(label="Select odds format", options=odds_display_options, index=odds_display_options.index(st.session_state.odds_display), horizontal=True, on_change=db.set_user_odds_display, args=(username, placeholder1), key='odds_display_key')
+    st.session_state.odds_display = st.sidebar.radio(label="Select odds format", options=odds_display_options, index=odds_display_options.index(st.session_state.odds_display), horizontal=True, on_change=db.set_user_odds_display, args=(username,), key='odds_display_key')
 
     # Create selectbox for timezone
     timezone_options = pytz.common_timezones
-    st.session_state.timezone = st.sidebar.selectbox(label="Select timezone", options=timezone_options, index=timezone_options.index(st.session_state.timezone), on_change=db.set_user_timezone, args=(username, placeholder1), key='timezone_key')
+    st.session_state.timezone = st.sidebar.selectbox(label="Select timezone", options=timezone_options, index=timezone_options.index(st.session_state.timezone), on_change=db.set_user_timezone, args=(username,), key='timezone_key')
 
     # Create selectbox for default sport
-    st.session_state.default_sport = st.sidebar.selectbox(label="Select default sport", options=list(SPORTS.keys()), index=list(SPORTS.keys()).index(st.session_state.default_sport), on_change=db.set_user_default_sport, args=(username, placeholder1), key='default_sport_key', help="This will be the default sport when adding a bet.")
+    st.session_state.default_sport = st.sidebar.selectbox(label="Select default sport", options=list(SPORTS.keys()), index=list(SPORTS.keys()).index(st.session_state.default_sport), on_change=db.set_user_default_sport, args=(username,), key='default_sport_key', help="This will be the default sport when adding a bet.")
 
     # Create selectbox for default book
-    st.session_state.default_book = st.sidebar.selectbox(label="Select default bookmaker", options=list(BOOKS), index=list(BOOKS).index(st.session_state.default_book), on_change=db.set_user_default_book, args=(username, placeholder1), key='default_book_key', help="This will be the default bookmaker when adding a bet.")
+    st.session_state.default_book = st.sidebar.selectbox(label="Select default bookmaker", options=list(BOOKS), index=list(BOOKS).index(st.session_state.default_book), on_change=db.set_user_default_book, args=(username,), key='default_book_key', help="This will be the default bookmaker when adding a bet.")
 
     # Create text input for default tag
-    st.session_state.default_tag = st.sidebar.text_input("Input default tag", value=st.session_state.default_tag, max_chars=25, on_change=db.set_user_default_tag, args=(username, placeholder1), key='default_tag_key', help="This will be the default tag when adding a bet.")
+    st.session_state.default_tag = st.sidebar.text_input("Input default tag", value=st.session_state.default_tag, max_chars=25, on_change=db.set_user_default_tag, args=(username,), key='default_tag_key', help="This will be the default tag when adding a bet.")
+
+    # Display connection pool statistics with ?pool_stats=1 in the url (admins only)
+    if username in ADMIN_USERS and st.query_params.get('pool_stats') == '1':
+        st.sidebar.json(db.get_pool_stats())
+
+    if st.session_state.stale_since is not None:
+        loaded_at = datetime.datetime.fromtimestamp(st.session_state.stale_since, pytz.timezone(st.session_state.timezone))
+        stale_notice.warning(f"Stale data: the database is currently unavailable, showing data loaded at {loaded_at.strftime('%Y-%m-%d %H:%M:%S')}", icon='⚠️')
 
     # Display logo and version
     st.sidebar.image(image="media/logo_sbic.png", use_container_width='auto')
@@ -1,27 +1,211 @@
 import time
+import uuid
+import datetime
 import pandas as pd
-import pendulum
+import pytz
 import streamlit as st
 import db_pinnacle_remote as db
 
+from config import SPORTS, PERIODS, BETS_PAGE_SIZE, BETS_DELETED_RETENTION, STORAGE_TIMEZONE
 
-def delete_bets(bets_to_be_deleted: set):
+
+def delete_bets(username: str, bets_to_be_deleted: set):
     """
+    Deletes the selected bets. Queued bets not inserted yet (temporary negative ids, see add_pending_bet) are skipped.
+
+    :param username: The username of the user who owns the bets
     :param bets_to_be_deleted: Set containing IDs of bets to be deleted
     :return: None
     """
-    for key in bets_to_be_deleted:
-        db.delete_bet(key=key)
-    st.cache_data.clear()
+    ids = [bet_id for bet_id in bets_to_be_deleted if bet_id >= 0]
+    if ids:
+        db.delete_bets(username=username, ids=ids)
+    if len(ids) < len(bets_to_be_deleted):
+        st.toast(PENDING_BETS_MESSAGE)
+
+
+def get_bets_pages(username: str, pages: int, after_starts: datetime.datetime = None, after_id: int = 0, **filters):
+    """
+    :param username: The username of the user
+    :param pages: The number of pages to load
+    :param after_starts: The starts of the last bet already loaded, None to load the first pages
+    :param after_id: The id of the last bet already loaded
+    :param filters: The filters of db.get_bets_page (sports, bookmakers, tags, bet_status, starts_from, starts_to)
+    :return: A tuple containing the bets of the pages (typed dataframe) and True if these are all filtered bets. Every page is cached, so loading one more page queries one page only.
+    """
+    bets = list()
+    for page in range(pages):
+        page_bets = db.get_bets_page(username=username, after_starts=after_starts, after_id=after_id, **filters)
+        bets.append(page_bets)
+        if len(page_bets) < BETS_PAGE_SIZE:
+            break
+        after_starts, after_id = page_bets['starts'].iloc[-1].to_pydatetime(), int(page_bets['id'].iloc[-1])
+
+    # Pages have different categories, concatenating falls back to object columns, so the schema is applied again
+    return db.typed_bets(pd.concat(bets, ignore_index=True)), len(bets[-1]) < BETS_PAGE_SIZE
+
+
+def load_session_bets(frame: dict, username: str, pages: int, **filters):
+    """
+    Loads the bets table of the session, i.e. the first pages of the filtered bets. The table is kept in the
+    session state: the bets are only downloaded again when the filters change, further pages are appended and
+    changes are merged in as deltas (see sync_bets).
+
+    Runs on a worker thread (see db.run_concurrently), so it doesn't write the session state. The caller stores
+    the returned table as st.session_state.bets_frame.
+
+    :param frame: The bets table of the session (st.session_state.bets_frame), None if there is none yet
+    :param username: The username of the user
+    :param pages: The number of pages to show
+    :param filters: The filters of db.get_bets_page (sports, bookmakers, tags, bet_status, starts_from, starts_to)
+    :return: The bets table of the session, a dictionary with the bets (typed dataframe) and all_loaded (True if these are all filtered bets)
+    """
+    if frame is None or frame['filters'] != filters:
+        # The sync point is taken first, so changes made during the load are picked up by the next delta poll
+        synced_at, version, polled_at = db.get_bets_sync_point(username=username), db.get_bets_version(username=username), time.time()
+        bets, all_loaded = get_bets_pages(username=username, pages=pages, **filters)
+        frame = dict(filters=filters, pages=pages, bets=bets, all_loaded=all_loaded, version=version, synced_at=synced_at, polled_at=polled_at, seen=set())
+
+    elif pages > frame['pages'] and not frame['all_loaded']:
+        last_bet = frame['bets'].iloc[-1]
+        bets, all_loaded = get_bets_pages(username=username, pages=pages - frame['pages'], after_starts=last_bet['starts'].to_pydatetime(), after_id=int(last_bet['id']), **filters)
+        frame = dict(frame, pages=pages, bets=db.typed_bets(pd.concat([frame['bets'], bets], ignore_index=True)), all_loaded=all_loaded)
+
+    return frame
+
+
+def sync_bets(username: str, refresh: bool = False):
+    """
+    Merges the bets changed since the last sync into the bets table of the session. This is one delta poll
+    (db.get_bets_changed_since) instead of downloading all bets again.
+
+    Runs on every page load after the user's own writes (the bets version of the user moved on) and on Refresh,
+    which picks up bets graded in the meantime. New changes by the grader invalidate the cached stats & filters of the user.
+
+    :param username: The username of the user
+    :param refresh: True to poll even if the user didn't write, i.e. for the Refresh button
+    :return: None
+    """
+    frame, version = st.session_state.get('bets_frame'), db.get_bets_version(username=username)
+
+    if frame is None:
+        if refresh:
+            db.bump_bets_version(username=username)
+        return
+
+    if frame['version'] == version and not refresh:
+        return
+
+    if time.time() - frame['polled_at'] > BETS_DELETED_RETENTION:
+        # Deleted bets may have been purged since the last poll, reload the bets table
+        del st.session_state['bets_frame']
+        db.bump_bets_version(username=username)
+        return
+
+    polled_at = time.time()
+    try:
+        changes, synced_at = db.get_bets_changed_since(username=username, since=frame['synced_at'])
+    except db.DatabaseUnavailableError:
+        # Keep showing the bets of the session (marked as stale), the next run polls again
+        db.mark_stale(frame['polled_at'])
+        return
+
+    # Rows of the overlap already merged by the previous poll don't count as new changes
+    seen = set(zip(changes['id'].tolist(), changes['updated_at'].tolist()))
+    new_changes = changes[[change not in frame['seen'] for change in zip(changes['id'].tolist(), changes['updated_at'].tolist())]]
+
+    if not new_changes.empty:
+        if frame['version'] == version:
+            db.bump_bets_version(username=username)
+        frame['bets'] = merge_bets(bets=frame['bets'], changes=new_changes, all_loaded=frame['all_loaded'], **frame['filters'])
+
+    frame.update(version=db.get_bets_version(username=username), synced_at=synced_at, polled_at=polled_at, seen=seen)
+
+
+def merge_bets(bets: pd.DataFrame, changes: pd.DataFrame, all_loaded: bool, sports: tuple, bookmakers: tuple, tags: tuple, bet_status: tuple, starts_from: datetime.datetime, starts_to: datetime.datetime):
+    """
+    Merges changed bets into a bets table: changed bets replace their previous version, deleted bets and bets no
+    longer matching the filters are dropped and new bets are inserted in (starts, id) order. If only the first
+    pages are loaded, bets sorting after the last loaded bet are left to the next pages.
+
+    :param bets: The bets table (typed dataframe)
+    :param changes: The changed bets as returned by db.get_bets_changed_since
+    :param all_loaded: True if the bets table holds all filtered bets
+    :param sports: The sports filter (encoded, see encode_filter)
+    :param bookmakers: The bookmakers filter (encoded)
+    :param tags: The tags filter (encoded)
+    :param bet_status: The bet status filter (encoded)
+    :param starts_from: The start of the starts filter (storage time)
+    :param starts_to: The end of the starts filter (storage time, excluded)
+    :return: The merged bets table (typed dataframe)
+    """
+    matching = changes[~changes['delete_bet'] & matches_filter(changes['sport_name'], sports) & matches_filter(changes['bookmaker'], bookmakers) & matches_filter(changes['tag'], tags) & matches_filter(changes['bet_status'], bet_status) & (changes['starts'] >= starts_from) & (changes['starts'] < starts_to)]
+
+    if not all_loaded and not bets.empty:
+        last_starts, last_id = bets['starts'].iloc[-1], bets['id'].iloc[-1]
+        matching = matching[(matching['starts'] < last_starts) | ((matching['starts'] == last_starts) & (matching['id'] <= last_id))]
 
+    # Queued bets (see add_pending_bet) are replaced by their inserted version, matched by the idempotency key
+    replaced = bets['id'].isin(changes['id']) | bets['idempotency_key'].isin(changes['idempotency_key'].dropna())
+    merged = pd.concat([bets[~replaced], matching.drop(columns='updated_at')], ignore_index=True)
+    return db.typed_bets(merged.sort_values(['starts', 'id'], ignore_index=True))
+
+
+def encode_filter(selected: tuple, options: list):
+    """
+    Encodes a multiselect filter so only what narrows the result is sent to the database, i.e. with thousands
+    of tags the default selection (everything) doesn't turn into a multi-kilobyte IN list. The values are sorted,
+    so equal selections share cache entries.
 
-def clear_cache():
+    :param selected: The selected values
+    :param options: All values the user could select
+    :return: None if all options are selected (no predicate), ('NOT IN', excluded values) if fewer values are excluded than selected, else ('IN', selected values)
     """
-    Clears the cached data for Streamlit application.
+    # NULL never matches IN and makes NOT IN match nothing, so it is left out
+    selected, excluded = {value for value in selected if value is not None}, {value for value in options if value is not None and value not in selected}
+    if not excluded:
+        return None
+    if len(excluded) < len(selected):
+        return 'NOT IN', tuple(sorted(excluded))
+    return 'IN', tuple(sorted(selected))
 
+
+def matches_filter(values: pd.Series, encoded: tuple):
+    """
+    :param values: The values of a bets column
+    :param encoded: A filter encoded by encode_filter
+    :return: A boolean series, True where the value passes the filter (same semantics as the SQL predicate)
+    """
+    if encoded is None:
+        return pd.Series(True, index=values.index)
+    operator, filter_values = encoded
+    return values.isin(filter_values) if operator == 'IN' else values.notna() & ~values.isin(filter_values)
+
+
+def add_pending_bet(data: dict):
+    """
+    Shows a queued bet (see db.queue_bet) in the bets table of the session right away. Until it is inserted, the
+    bet has a temporary negative id. The delta poll after the insert replaces it (matched by the idempotency key).
+
+    :param data: The bet as passed to db.queue_bet
     :return: None
     """
-    st.cache_data.clear()
+    frame = st.session_state.get('bets_frame')
+    if frame is None:
+        return
+
+    st.session_state.pending_bet_id = st.session_state.get('pending_bet_id', 0) - 1
+    bet = pd.DataFrame([{column: data.get(column) for column in frame['bets'].columns}]).assign(id=st.session_state.pending_bet_id, delete_bet=False, updated_at=datetime.datetime.now())
+    frame['bets'] = merge_bets(bets=frame['bets'], changes=db.typed_bets(bet), all_loaded=frame['all_loaded'], **frame['filters'])
+
+
+def load_more_bets():
+    """
+    Loads one more page of bets into the bets table on the next run.
+
+    :return: None
+    """
+    st.session_state.bets_pages += 1
 
 
 def color_cells(val: (str, int, float)):
@@ -132,176 +316,256 @@ def get_rating(clv: float):
         return 'D', 'poor', 'red'
 
 
-@st.cache_resource()
-def get_active_session(username: str):
+def filter_facets(facets: pd.DataFrame, **filters: tuple):
     """
-    :return: The session ID of the active session for the specified user.
+    :param facets: Dataframe as returned by db.get_user_facets
+    :param filters: Column name -> tuple of selected values, i.e. sport_name=('Soccer', 'Tennis')
+    :return: The facet rows matching all given filters.
     """
-    return st.session_state.session_id
+    mask = pd.Series(True, index=facets.index)
+    for column, values in filters.items():
+        mask &= facets[column].isin(values)
+    return facets[mask]
 
 
-def tz_diff(home, away, on=None):
+def get_facet_options(facets: pd.DataFrame, column: str, **filters: tuple):
+    """
+    :param facets: Dataframe as returned by db.get_user_facets
+    :param column: The facet column for which the options are returned, i.e. 'bookmaker'
+    :param filters: Column name -> tuple of selected values of the preceding (cascading) filters
+    :return: A list of unique values of the column for all bets matching the filters.
     """
-    Return the difference in hours between the away time zone and home.
+    return filter_facets(facets, **filters)[column].unique().tolist()
 
-    `home` and `away` may be any values which pendulum parses as timezones.
-    However, recommended use is to specify the full formal name.
-    See https://gist.github.com/pamelafox/986163
 
-    As not all time zones are separated by an integer number of hours, this
-    function returns a float.
+def get_facet_date_range(facets: pd.DataFrame, timezone: str = STORAGE_TIMEZONE, **filters: tuple):
+    """
+    :param facets: Dataframe as returned by db.get_user_facets
+    :param timezone: The timezone of the user
+    :param filters: Column name -> tuple of selected values
+    :return: A tuple containing the earliest and latest event start (local time of the user) of all bets matching the filters. (None, None) if there are no such bets.
+    """
+    facets = filter_facets(facets, **filters)
+    if facets.empty:
+        return None, None
+    return to_local_time(facets['starts_min'].min().to_pydatetime(), timezone), to_local_time(facets['starts_max'].max().to_pydatetime(), timezone)
 
-    As time zones are political entities, their definitions can change over time.
-    This is complicated by the fact that daylight savings time does not start
-    and end on the same days uniformly across the globe. This means that there are
-    certain days of the year when the returned value between `Europe/Berlin` and
-    `America/New_York` is _not_ `6.0`.
 
-    By default, this function always assumes that you want the current
-    definition. If you prefer to specify, set `on` to the date of your choice.
-    It should be a `Pendulum` object.
+def to_local_time(starts: datetime.datetime, timezone: str):
+    """
+    :param starts: A timestamp in storage time (naive, STORAGE_TIMEZONE)
+    :param timezone: The timezone of the user
+    :return: The timestamp in local time of the user (naive)
+    """
+    return pytz.timezone(STORAGE_TIMEZONE).localize(starts).astimezone(pytz.timezone(timezone)).replace(tzinfo=None)
 
-    This function returns the number of hours which must be added to the home time
-     to get the away time. For example,
-    ```python
-    >>> tz_diff('Europe/Berlin', 'America/New_York')
-    -6.0
-    >>> tz_diff('Europe/Berlin', 'Asia/Kabul')
-    2.5
-    ```
+
+def get_storage_range(date_from: datetime.date, date_to: datetime.date, timezone: str):
+    """
+    Converts a range of local dates of the user into the half-open range of storage times it covers, i.e. from
+    midnight of date_from up to (excluding) midnight after date_to in the user's timezone, both converted to
+    STORAGE_TIMEZONE. Compared with the bare starts column, these bounds are index range scans and cover exactly
+    the user's local days, including half-hour offsets and DST changes within the range.
+
+    :param date_from: The first local date of the range
+    :param date_to: The last local date of the range (inclusive)
+    :param timezone: The timezone of the user
+    :return: A tuple (starts_from, starts_to) of naive storage-time datetimes, starts_to excluded
     """
-    if on is None:
-        on = pendulum.today()
-    diff = (on.set(tz=home) - on.set(tz=away)).total_hours()
+    local_timezone, storage_timezone = pytz.timezone(timezone), pytz.timezone(STORAGE_TIMEZONE)
+    starts_from = local_timezone.localize(datetime.datetime.combine(date_from, datetime.time.min)).astimezone(storage_timezone).replace(tzinfo=None)
+    starts_to = local_timezone.localize(datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min)).astimezone(storage_timezone).replace(tzinfo=None)
+    return starts_from, starts_to
 
-    # what about the diff from Tokyo to Honolulu? Right now the result is -19.0
-    # it should be 5.0; Honolulu is naturally east of Tokyo, just not so around
-    # the date line
-    if abs(diff) > 12.0:
-        if diff < 0.0:
-            diff += 24.0
-        else:
-            diff -= 24.0
 
-    return diff
+@st.cache_resource()
+def get_active_session(username: str):
+    """
+    :return: The session ID of the active session for the specified user.
+    """
+    return st.session_state.session_id
 
 
-def update_bet(initial_df: pd.DataFrame, edited_df: pd.DataFrame, placeholder: st.delta_generator.DeltaGenerator):
+def update_bets(initial_df: pd.DataFrame, edited_df: pd.DataFrame, username: str):
     """
-    Updates an existing dataset by comparing it with an edited dataset and applying changes
-    if discrepancies are found. The function cross-references specific fields in the provided
-    dataframes and updates the database for any modifications, with input validation for
-    specific fields. Updates are displayed on a streamlit placeholder for interactive feedback.
+    Compares the edited dataframe with the initial dataframe and writes all valid changes of one
+    data_editor interaction to the database in a single transaction. Invalid inputs and edits of queued
+    bets not inserted yet (temporary negative ids, see add_pending_bet) are skipped.
+    The result is reported with one non-blocking toast.
 
     :param initial_df: The initial dataframe containing records before any edits.
     :type initial_df: pd.DataFrame
     :param edited_df: The edited dataframe containing proposed updates to the records.
     :type edited_df: pd.DataFrame
-    :param placeholder: A streamlit delta generator for displaying status or alerts during
-        the update process.
-    :type placeholder: st.delta_generator.DeltaGenerator
+    :param username: The username of the user who owns the bets.
+    :type username: str
     :return: None
     """
+    edited_df = edited_df.drop_duplicates(subset='ID').set_index('ID')
+    changes, invalid_messages, pending_edited = dict(), list(), False
+
     for index, row in initial_df.iterrows():
 
-        # Check & update current vs previous TAG
-        initial_value = row['TAG']
-        try:
-            edited_value = edited_df[edited_df['ID'] == row['ID']]['TAG'].iloc[0]
-        except Exception:
-            edited_value = initial_value
-
-        if edited_value != initial_value:
-
-            if isinstance(edited_value, str):
-                db.update_bet(dbid=row['ID'], column_name='tag', column_value=edited_value, placeholder=placeholder)
-
-            else:
-                placeholder.info('Invalid input. Please enter a string')
-                time.sleep(2.5)
-                placeholder.empty()
-
-        # Check & update current vs previous BOOKMAKER
-        initial_value = row['BOOK']
-        try:
-            edited_value = edited_df[edited_df['ID'] == row['ID']]['BOOK'].iloc[0]
-        except Exception:
-            edited_value = initial_value
-
-        if edited_value != initial_value:
-
-            if isinstance(edited_value, str):
-                db.update_bet(dbid=row['ID'], column_name='bookmaker', column_value=edited_value, placeholder=placeholder)
-
-            else:
-                placeholder.info('Invalid input. Please enter a string')
-                time.sleep(2.5)
-                placeholder.empty()
-
-        # Check & update current vs previous BET_STATUS
-        initial_value = row['ST']
-        try:
-            edited_value = edited_df[edited_df['ID'] == row['ID']]['ST'].iloc[0]
-        except Exception:
-            edited_value = initial_value
-
-        if edited_value != initial_value:
-
-            if edited_value in ('W', 'HW', 'L', 'HL', 'P', 'V'):
-                db.update_bet(dbid=row['ID'], column_name='bet_status', column_value=edited_value, placeholder=placeholder)
-
-            else:
-                placeholder.info('Invalid input. Allowed values are: W, HW, L, HL, P, V')
-                time.sleep(2.5)
-                placeholder.empty()
-
-        # Check & update current vs previous SCORE_HOME
-        initial_value = row['SH']
-        try:
-            edited_value = edited_df[edited_df['ID'] == row['ID']]['SH'].iloc[0]
-        except Exception:
-            edited_value = initial_value
-
-        if edited_value != initial_value:
-
-            if edited_value is not None and edited_value >= 0:
-                db.update_bet(dbid=row['ID'], column_name='score_home', column_value=edited_value, placeholder=placeholder)
-
-            else:
-                placeholder.info('Invalid input. Please enter a whole number >= 0')
-                time.sleep(2.5)
-                placeholder.empty()
-
-        # Check & update current vs previous SCORE_AWAY
-        initial_value = row['SA']
-        try:
-            edited_value = edited_df[edited_df['ID'] == row['ID']]['SA'].iloc[0]
-        except Exception:
-            edited_value = initial_value
-
-        if edited_value != initial_value:
-
-            if edited_value is not None and edited_value >= 0:
-                db.update_bet(dbid=row['ID'], column_name='score_away', column_value=edited_value, placeholder=placeholder)
-
-            else:
-                placeholder.info('Invalid input. Please enter a whole number >= 0')
-                time.sleep(2.5)
-                placeholder.empty()
-
-        # Check & update current vs previous P/L
-        initial_value = row['P/L']
-        try:
-            edited_value = edited_df[edited_df['ID'] == row['ID']]['P/L'].iloc[0]
-        except Exception:
-            edited_value = initial_value
-
-        if edited_value != initial_value:
-
-            if edited_value is not None and 1000000 > edited_value > -1000000:
-                db.update_bet(dbid=row['ID'], column_name='profit', column_value=edited_value, placeholder=placeholder)
-
-            else:
-                placeholder.info('Invalid input. Please enter a whole number >= 0')
-                time.sleep(2.5)
-                placeholder.empty()
+        if row['ID'] not in edited_df.index:
+            continue
+
+        for column, (column_name, is_valid, invalid_message) in EDITABLE_BET_COLUMNS.items():
+            initial_value = row[column]
+            edited_value = edited_df.at[row['ID'], column]
+
+            if edited_value != initial_value:
+
+                if row['ID'] < 0:
+                    pending_edited = True
+
+                elif is_valid(edited_value):
+                    # numpy scalars are converted to python types for the database driver
+                    changes.setdefault(column_name, list()).append((int(row['ID']), edited_value.item() if hasattr(edited_value, 'item') else edited_value))
+
+                elif invalid_message not in invalid_messages:
+                    invalid_messages.append(invalid_message)
+
+    message = list()
+    if changes:
+        count = db.update_bets(username=username, changes=changes)
+        message.append(f'{count} change(s) saved successfully.')
+    if invalid_messages:
+        message.append(f"Invalid input. {' '.join(invalid_messages)}")
+    if pending_edited:
+        message.append(PENDING_BETS_MESSAGE)
+    if message:
+        st.toast(' '.join(message))
+
+
+# Shown if queued bets (temporary negative ids) are edited or deleted before they are inserted
+PENDING_BETS_MESSAGE = 'New bets are still being saved and can be edited or deleted after a Refresh.'
+
+# Shown if a read fails or is skipped by the open circuit breaker and there is no earlier result to show (see db.guarded_read)
+DATABASE_UNAVAILABLE_MESSAGE = 'The database is currently unavailable, please try again in a minute.'
+
+# Data editor column -> (database column, validation, message if invalid)
+EDITABLE_BET_COLUMNS = {'TAG': ('tag', lambda value: isinstance(value, str), 'Please enter a string.'),
+                        'BOOK': ('bookmaker', lambda value: isinstance(value, str), 'Please enter a string.'),
+                        'ST': ('bet_status', lambda value: value in ('W', 'HW', 'L', 'HL', 'P', 'V'), 'Allowed values are: W, HW, L, HL, P, V'),
+                        'SH': ('score_home', lambda value: value is not None and value >= 0, 'Please enter a whole number >= 0'),
+                        'SA': ('score_away', lambda value: value is not None and value >= 0, 'Please enter a whole number >= 0'),
+                        'P/L': ('profit', lambda value: value is not None and 1000000 > value > -1000000, 'Please enter a number between -1000000 and 1000000')}
+
+
+# Accepted spellings of the side column for imported bets
+IMPORT_SIDES = {'odds1': 'odds1', 'home': 'odds1', 'over': 'odds1', '1': 'odds1',
+                'odds0': 'odds0', 'draw': 'odds0', 'x': 'odds0',
+                'odds2': 'odds2', 'away': 'odds2', 'under': 'odds2', '2': 'odds2'}
+
+
+def read_bet_import(uploaded_file: st.runtime.uploaded_file_manager.UploadedFile):
+    """
+    :param uploaded_file: A CSV or Parquet file uploaded with st.file_uploader
+    :return: The uploaded bets as a dataframe with lower case column names.
+    """
+    if uploaded_file.name.lower().endswith('.parquet'):
+        upload_df = pd.read_parquet(uploaded_file)
+    else:
+        upload_df = pd.read_csv(uploaded_file)
+    upload_df.columns = [column.strip().lower() for column in upload_df.columns]
+    return upload_df
+
+
+def prepare_bet_import(upload_df: pd.DataFrame, username: str, default_book: str, default_tag: str):
+    """
+    Validates imported bets against the fixtures and odds tables and builds the bet records.
+
+    Every bet is keyed by event_id, market, period, side and line (line is ignored for moneyline bets)
+    and needs odds & stake. Optional columns are bookmaker and tag. Fixtures and odds of all events are
+    fetched with one query per chunk of event IDs and matched with joins, not row by row.
+
+    :param upload_df: Dataframe with the uploaded bets, see read_bet_import
+    :param username: The username of the user importing the bets
+    :param default_book: Bookmaker used for bets without a bookmaker
+    :param default_tag: Tag used for bets without a tag
+    :return: A tuple containing the list of valid bet records (see db.append_bet) and a dataframe of the rejected rows with a 'reason' column.
+    """
+    missing_columns = {'event_id', 'market', 'period', 'side', 'odds', 'stake'} - set(upload_df.columns)
+    if missing_columns:
+        rejected = upload_df.copy()
+        rejected['reason'] = f"Missing column(s): {', '.join(sorted(missing_columns))}"
+        return list(), rejected
+
+    bets = upload_df.copy()
+    bets['row'] = range(1, len(bets) + 1)
+    bets['reason'] = None
+    if 'line' not in bets.columns:
+        bets['line'] = None
+    for column, default in (('bookmaker', default_book), ('tag', default_tag)):
+        if column not in bets.columns:
+            bets[column] = default
+        bets[column] = bets[column].fillna(default)
+
+    bets['market'] = bets['market'].astype(str).str.strip().str.lower()
+    bets['side'] = bets['side'].astype(str).str.strip().str.lower().map(IMPORT_SIDES)
+    bets['event_id'] = pd.to_numeric(bets['event_id'], errors='coerce')
+    bets['period'] = pd.to_numeric(bets['period'], errors='coerce')
+    for column in ('line', 'odds', 'stake'):
+        bets[column] = pd.to_numeric(bets[column], errors='coerce')
+    bets['tag'] = bets['tag'].astype(str).str.slice(0, 25)
+    # The line is ignored for moneyline bets, all other markets need one
+    bets.loc[bets['market'] == 'moneyline', 'line'] = 0.0
+
+    bets.loc[bets['side'].isna(), 'reason'] = 'Invalid side'
+    bets.loc[bets['odds'].isna() | (bets['odds'] < 1.001), 'reason'] = 'Invalid odds'
+    bets.loc[bets['stake'].isna() | (bets['stake'] < 0.01), 'reason'] = 'Invalid stake'
+    bets.loc[bets['event_id'].isna() | bets['period'].isna() | bets['line'].isna(), 'reason'] = 'Invalid event_id, period or line (spread & totals need a line)'
+
+    # Match fixtures
+    fixtures = db.get_fixtures_by_event_ids(event_ids=bets.loc[bets['reason'].isna(), 'event_id'].unique().tolist())
+    bets = bets.merge(fixtures, on='event_id', how='left')
+    bets.loc[bets['reason'].isna() & bets['starts'].isna(), 'reason'] = 'Unknown event_id'
+
+    # The home line is stored as raw_line, i.e. the line of an away spread bet is inverted (see bet form)
+    bets['raw_line'] = bets['line'].where(~((bets['market'] == 'spread') & (bets['side'] == 'odds2')), -bets['line'])
+    bets.loc[bets['market'] == 'moneyline', ['raw_line', 'line']] = 0.0
+
+    # Match odds: only the odds lines of the imported markets are read, one row per event/market/period/line
+    keys = bets.loc[bets['reason'].isna(), ['event_id', 'market', 'period']].drop_duplicates()
+    odds = db.get_odds_by_import_keys(keys=list(keys.itertuples(index=False, name=None)))
+    odds['raw_line'] = odds['line'].where(odds['market'] != 'moneyline', 0.0).astype(float).round(2)
+    odds = odds.groupby(['event_id', 'period', 'market', 'raw_line'], as_index=False)[['odds1', 'odds0', 'odds2']].max()
+    bets['raw_line'] = bets['raw_line'].astype(float).round(2)
+    bets = bets.merge(odds, on=['event_id', 'period', 'market', 'raw_line'], how='left')
+    has_odds = pd.Series(False, index=bets.index)
+    for side in ('odds1', 'odds0', 'odds2'):
+        has_odds |= (bets['side'] == side) & bets[side].notna()
+    bets.loc[bets['reason'].isna() & ~has_odds, 'reason'] = 'No odds available for market/period/side/line'
+
+    bets['sport_name'] = bets['sport_id'].map({sport_id: sport_name for sport_name, sport_id in SPORTS.items()})
+    bets['period_name'] = [PERIODS.get((sport_id, period)) for sport_id, period in zip(bets['sport_id'], bets['period'])]
+    bets.loc[bets['reason'].isna() & (bets['sport_name'].isna() | bets['period_name'].isna()), 'reason'] = 'Unsupported sport or period'
+
+    rejected = bets.loc[bets['reason'].notna(), ['row'] + upload_df.columns.tolist() + ['reason']]
+    bets = bets[bets['reason'].isna()].copy()
+
+    bets['side_name'] = bets['side'].map({'odds1': 'Over', 'odds2': 'Under'})
+    is_runner_market = bets['market'].isin(('moneyline', 'spread'))
+    bets.loc[is_runner_market & (bets['side'] == 'odds1'), 'side_name'] = bets['runner_home']
+    bets.loc[is_runner_market & (bets['side'] == 'odds2'), 'side_name'] = bets['runner_away']
+    bets.loc[bets['side'] == 'odds0', 'side_name'] = 'Draw'
+
+    bets['user'] = username
+    bets['bet_status'] = 'na'
+    bets[['score_home', 'score_away']] = 0
+    bets[['profit', 'cls_odds', 'true_cls', 'cls_limit', 'ev', 'clv']] = 0.00
+    bets['bet_added'] = datetime.datetime.now()
+    # Deterministic idempotency keys: importing the same file again skips the bets imported before. Identical rows
+    # within one file are told apart by their occurrence, so they are all imported
+    key_columns = ['event_id', 'market', 'period', 'side', 'raw_line', 'odds', 'stake', 'bookmaker', 'tag']
+    occurrence = bets.groupby(key_columns, sort=False, dropna=False).cumcount()
+    bets['idempotency_key'] = [str(uuid.uuid5(uuid.NAMESPACE_OID, '|'.join(map(str, (username, *values, count))))) for values, count in zip(bets[key_columns].itertuples(index=False), occurrence)]
+    bets['event_id'] = bets['event_id'].astype(int)
+    bets['period'] = bets['period'].astype(int)
+
+    # Object dtype converts numpy scalars to python types for the database driver, which doesn't accept pandas timestamps either
+    bets = bets[list(db.BET_COLUMNS)].astype(object)
+    bets = bets.where(bets.notna(), None).to_dict('records')
+    for data in bets:
+        data['starts'], data['bet_added'] = data['starts'].to_pydatetime(), data['bet_added'].to_pydatetime()
+    return bets, rejected